@@ -0,0 +1,57 @@
+"""Compares role lookups and custom_id routing against a guild with thousands of roles.
+
+Run from the repository root: python -m benchmarks.component_routing
+"""
+import asyncio
+import timeit
+from types import SimpleNamespace
+
+import disnake
+
+from interaction_router import ComponentRouter, GuildNameIndex
+
+ROLES = 5000
+CHANNELS = 2000
+NUMBER = 2000
+
+
+def fake_guild():
+    guild = SimpleNamespace(id=1)
+    guild.roles = [SimpleNamespace(id=i, name=f"cup{i}-tournament", guild=guild) for i in range(ROLES)]
+    guild.channels = [SimpleNamespace(id=ROLES + i, name=f"cup{i}-confirmation", guild=guild)
+                      for i in range(CHANNELS)]
+    return guild
+
+
+def report(name, seconds):
+    print(f"{name:<32} {seconds / NUMBER * 1e6:>10.2f} µs/lookup")
+
+
+def main():
+    guild = fake_guild()
+    index = GuildNameIndex()
+    index.get_role(guild, "warm-up")
+    # The worst case for a linear scan: the newest tournament role sits at the end of the list
+    name = f"cup{ROLES - 1}-tournament"
+
+    report("disnake.utils.get(roles)", timeit.timeit(lambda: disnake.utils.get(guild.roles, name=name),
+                                                     number=NUMBER))
+    report("GuildNameIndex.get_role", timeit.timeit(lambda: index.get_role(guild, name), number=NUMBER))
+
+    router = ComponentRouter()
+    for i in range(50):
+        router.route(f"noise{i}", str)(lambda inter, value: None)
+
+    async def handler(inter, tournament, page):
+        pass
+
+    router.route("roster_page", str, int)(handler)
+    inter = SimpleNamespace(data=SimpleNamespace(custom_id="roster_page:cup:3"))
+    loop = asyncio.new_event_loop()
+    report("ComponentRouter.dispatch", timeit.timeit(lambda: loop.run_until_complete(router.dispatch(inter)),
+                                                     number=NUMBER))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
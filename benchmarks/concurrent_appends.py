@@ -0,0 +1,62 @@
+"""Fires many simultaneous add_new_user calls at a fake worksheet and checks that no row is lost.
+
+Run from the repository root: python -m benchmarks.concurrent_appends
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("USERS_DATABASE_TABLE", "USERS_DATABASE!A2:J")
+# The fake spreadsheet has no quota, so the shared rate limits would only slow the run down
+os.environ.setdefault("SHEETS_READ_RATE", "1000")
+os.environ.setdefault("SHEETS_WRITE_RATE", "1000")
+
+from benchmarks.fakes import FakeSpreadsheet
+from google_sheets_manager_v2 import GoogleSheetsManager
+from sheets_write_queue import SheetsWriteQueue
+
+HEADER = ["Nickname", "Phone", "Branch", "Teammates", "Discord", "Game", "Format", "Tournament", "Tournament name",
+          "Added"]
+USERS = 200
+
+
+def user_row(i):
+    return [f"player{i}", "+000", "Branch", "", f"discord{i}", "FORTNITE", "1x1", "bench", "Bench cup"]
+
+
+def check(name, spreadsheet):
+    rows = spreadsheet.worksheets["USERS_DATABASE"].rows[1:]
+    nicknames = {row[0] for row in rows if row}
+    lost = USERS - len(nicknames & {f"player{i}" for i in range(USERS)})
+    print(f"{name:<12} rows: {len(rows):>4}  lost: {lost}  duplicates: {len(rows) - len(nicknames)}  "
+          f"api calls: {dict(spreadsheet.calls)}")
+    return lost == 0 and len(rows) == len(nicknames)
+
+
+async def direct():
+    spreadsheet = FakeSpreadsheet(rows=[HEADER], latency=0.01)
+    manager = GoogleSheetsManager("fake", sheets=[spreadsheet])
+    await asyncio.gather(*(manager.add_new_user(user_row(i)) for i in range(USERS)))
+    return check("direct", spreadsheet)
+
+
+async def queued():
+    spreadsheet = FakeSpreadsheet(rows=[HEADER], latency=0.01)
+    manager = GoogleSheetsManager("fake", sheets=[spreadsheet])
+    with tempfile.TemporaryDirectory() as directory:
+        queue = SheetsWriteQueue(manager, flush_interval=0.05, journal_path=os.path.join(directory, "journal.jsonl"))
+        await queue.start()
+        await asyncio.gather(*(queue.add_new_user(user_row(i)) for i in range(USERS)))
+        await queue.close()
+    return check("write queue", spreadsheet)
+
+
+async def main():
+    results = [await direct(), await queued()]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
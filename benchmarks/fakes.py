@@ -0,0 +1,325 @@
+import asyncio
+import functools
+import itertools
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from aiohttp import web
+from gspread.utils import a1_to_rowcol
+
+
+def cell_value(cell):
+    value = cell.get("userEnteredValue", {})
+    if "boolValue" in value:
+        return "TRUE" if value["boolValue"] else "FALSE"
+    return value.get("stringValue", "")
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, rows=None, sheet_id=0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = sheet_id
+        self.rows = [list(row) for row in rows or []]
+
+    def _ensure(self, row_index):
+        while len(self.rows) <= row_index:
+            self.rows.append([])
+
+    def _set(self, row_index, column_index, value):
+        self._ensure(row_index)
+        row = self.rows[row_index]
+        row += [""] * (column_index + 1 - len(row))
+        row[column_index] = value
+
+    def last_row(self):
+        for index in range(len(self.rows), 0, -1):
+            if any(self.rows[index - 1]):
+                return index
+        return 0
+
+    def get(self, cell_range):
+        self.spreadsheet.call("values_get")
+        start, end = cell_range.split(":")
+        row, col = a1_to_rowcol(start)
+        end_col = a1_to_rowcol(end + "1")[1] if end.isalpha() else a1_to_rowcol(end)[1]
+        values = []
+        for source in self.rows[row - 1:]:
+            values.append(list(source[col - 1:end_col]))
+        while values and not any(values[-1]):
+            values.pop()
+        return [value[:max((i + 1 for i, v in enumerate(value) if v), default=0)] for value in values]
+
+    def col_values(self, col):
+        self.spreadsheet.call("values_get")
+        values = [row[col - 1] if len(row) >= col else "" for row in self.rows[:self.last_row()]]
+        return values
+
+    def delete_rows(self, index):
+        self.spreadsheet.call("batch_update")
+        with self.spreadsheet.lock:
+            if index - 1 < len(self.rows):
+                del self.rows[index - 1]
+
+
+class FakeSpreadsheet:
+    """In-process stand-in for gspread.Spreadsheet that counts API round trips."""
+
+    def __init__(self, rows=None, title="USERS_DATABASE", latency=0.0, quota_errors=0):
+        self.calls = Counter()
+        self.latency = latency
+        self.quota_errors = quota_errors
+        self.lock = threading.Lock()
+        self.worksheets = {title: FakeWorksheet(self, title, rows)}
+
+    def call(self, name):
+        with self.lock:
+            self.calls[name] += 1
+            raise_quota = self.quota_errors > 0
+            if raise_quota:
+                self.quota_errors -= 1
+        if self.latency:
+            time.sleep(self.latency)
+        if raise_quota:
+            raise QuotaExceeded()
+
+    def worksheet(self, title):
+        self.call("fetch_sheet_metadata")
+        return self.worksheets[title]
+
+    def batch_update(self, body):
+        self.call("batch_update")
+        with self.lock:
+            for request in body["requests"]:
+                if "appendCells" in request:
+                    worksheet = self._by_id(request["appendCells"]["sheetId"])
+                    for row in request["appendCells"]["rows"]:
+                        row_index = worksheet.last_row()
+                        for column, cell in enumerate(row["values"]):
+                            worksheet._set(row_index, column, cell_value(cell))
+                elif "updateCells" in request:
+                    update = request["updateCells"]
+                    if "userEnteredValue" not in update["fields"]:
+                        continue
+                    worksheet = self._by_id(update["start"]["sheetId"])
+                    for offset, row in enumerate(update["rows"]):
+                        for column, cell in enumerate(row["values"]):
+                            worksheet._set(update["start"]["rowIndex"] + offset,
+                                           update["start"]["columnIndex"] + column, cell_value(cell))
+        return {"replies": []}
+
+    def _by_id(self, sheet_id):
+        return next(worksheet for worksheet in self.worksheets.values() if worksheet.id == sheet_id)
+
+
+class QuotaExceeded(Exception):
+    status_code = 429
+
+
+class FakeChallongeServer:
+    """Local aiohttp app speaking the subset of the Challonge v1 API that ChallongeClient uses."""
+
+    def __init__(self, latency=0.0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.tournaments = {}
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def add_tournament(self, tournament_id, name, state="pending"):
+        self.tournaments[tournament_id] = {"tournament": {"id": tournament_id, "name": name, "state": state},
+                                           "participants": []}
+
+    def _participant(self, name):
+        return {"participant": {"id": next(self._ids), "name": name}}
+
+    async def _handle(self, request, name):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        tournament = self.tournaments.get(request.match_info["tournament"])
+        if tournament is None:
+            return web.json_response({"errors": ["Requested tournament was not found"]}, status=404)
+
+        if name == "get_tournament":
+            return web.json_response({"tournament": tournament["tournament"]})
+        if name == "get_participants":
+            return web.json_response(tournament["participants"])
+        if name == "add_participant":
+            participant = self._participant((await request.json())["participant"]["name"])
+            tournament["participants"].append(participant)
+            return web.json_response(participant)
+        if name == "bulk_add_participants":
+            added = [self._participant(item["name"]) for item in (await request.json())["participants"]]
+            tournament["participants"].extend(added)
+            return web.json_response(added)
+        participant_id = int(request.match_info["participant"])
+        tournament["participants"] = [participant for participant in tournament["participants"]
+                                      if participant["participant"]["id"] != participant_id]
+        return web.json_response({})
+
+    async def start(self):
+        app = web.Application()
+        for method, path, name in [
+            ("GET", "/tournaments/{tournament}.json", "get_tournament"),
+            ("GET", "/tournaments/{tournament}/participants.json", "get_participants"),
+            ("POST", "/tournaments/{tournament}/participants.json", "add_participant"),
+            ("POST", "/tournaments/{tournament}/participants/bulk_add.json", "bulk_add_participants"),
+            ("DELETE", "/tournaments/{tournament}/participants/{participant}.json", "delete_participant"),
+        ]:
+            app.router.add_route(method, path, functools.partial(self._handle, name=name))
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class FakeDiscord:
+    """Counts the Discord REST calls made through the fake objects below and adds per-call latency."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._ids = itertools.count(10 ** 6)
+
+    async def call(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def next_id(self):
+        return next(self._ids)
+
+
+class FakeRole:
+    def __init__(self, discord, guild, name):
+        self.id = discord.next_id()
+        self.name = name
+        self.guild = guild
+
+
+class FakeGuild:
+    def __init__(self, discord, guild_id=1):
+        self.discord = discord
+        self.id = guild_id
+        self.roles = []
+        self.channels = []
+
+    def add_role(self, name):
+        role = FakeRole(self.discord, self, name)
+        self.roles.append(role)
+        return role
+
+    def add_channel(self, name):
+        channel = FakeChannel(self.discord, self, name)
+        self.channels.append(channel)
+        return channel
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+
+class FakeMessage:
+    def __init__(self, discord, channel, message_id):
+        self.discord = discord
+        self.channel = channel
+        self.id = message_id
+        self.flags = SimpleNamespace(ephemeral=False)
+
+    async def edit(self, **kwargs):
+        await self.discord.call("edit_message")
+
+
+class FakeChannel:
+    def __init__(self, discord, guild, name):
+        self.discord = discord
+        self.guild = guild
+        self.id = discord.next_id()
+        self.name = name
+        self.category = None
+
+    async def send(self, **kwargs):
+        await self.discord.call("send_message")
+        return FakeMessage(self.discord, self, self.discord.next_id())
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self.discord, self, message_id)
+
+    async def history(self, limit=None, oldest_first=False):
+        await self.discord.call("history")
+        return
+        yield
+
+    async def purge(self, **kwargs):
+        await self.discord.call("purge")
+
+
+class FakeMember:
+    def __init__(self, discord, name):
+        self.discord = discord
+        self.id = discord.next_id()
+        self.name = name
+        self.roles = set()
+
+    async def add_roles(self, *roles):
+        await self.discord.call("add_roles")
+        self.roles.update(role.id for role in roles)
+
+    async def remove_roles(self, *roles):
+        await self.discord.call("remove_roles")
+        self.roles.difference_update(role.id for role in roles)
+
+
+class FakeResponse:
+    def __init__(self, discord):
+        self.discord = discord
+        self.messages = []
+
+    async def send_message(self, content=None, **kwargs):
+        await self.discord.call("interaction_response")
+        self.messages.append(content)
+
+    async def defer(self, **kwargs):
+        await self.discord.call("interaction_response")
+
+    async def send_modal(self, modal):
+        await self.discord.call("interaction_response")
+
+    async def edit_message(self, **kwargs):
+        await self.discord.call("interaction_response")
+
+
+class FakeFollowup:
+    def __init__(self, discord):
+        self.discord = discord
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        await self.discord.call("followup")
+        self.messages.append(content)
+
+
+class FakeInteraction:
+    """Stands in for both disnake.ModalInteraction and disnake.MessageInteraction."""
+
+    def __init__(self, discord, user, channel, custom_id=None, text_values=None):
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.data = SimpleNamespace(custom_id=custom_id)
+        self.text_values = text_values or {}
+        self.response = FakeResponse(discord)
+        self.followup = FakeFollowup(discord)
@@ -0,0 +1,221 @@
+"""Replays a registration storm against fake Sheets, Challonge and Discord and reports latency and API usage.
+
+Hundreds of concurrent registration modal submits (some of them double-clicked) and cancel-button presses run
+while the participant service syncs the sheet with Challonge. Everything runs in-process and offline.
+
+Run from the repository root: python -m benchmarks.registration_storm [--users 300] [--cancel 0.2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("USERS_DATABASE_TABLE", "USERS_DATABASE!A2:J")
+# The fakes have no quota and one confirmation channel takes the whole storm, so the shared limits are lifted
+os.environ.setdefault("SHEETS_READ_RATE", "1000")
+os.environ.setdefault("SHEETS_WRITE_RATE", "1000")
+os.environ.setdefault("CHALLONGE_RATE_LIMIT", "1000")
+os.environ.setdefault("CHANNEL_THROTTLE_RATE", "1000")
+os.environ.setdefault("CHANNEL_THROTTLE_BURST", "1000")
+
+from benchmarks.fakes import FakeChallongeServer, FakeDiscord, FakeGuild, FakeInteraction, FakeMember, \
+    FakeSpreadsheet
+from challonge_cache import ChallongeCache
+from challonge_client import ChallongeClient
+from choices_list import FORMAT
+from google_sheets_manager_v2 import GoogleSheetsManager
+from interaction_router import GuildNameIndex
+from modals.registration_modal import RegistrationModalOne
+from rate_limiter import BACKGROUND, priority
+from registration_cancel import cancel_registration
+from registration_store import RegistrationStore
+from roster_manager import RosterManager
+from sheets_write_queue import SheetsWriteQueue
+from state_store import StateStore
+from throttling import InteractionGuard
+from tournament_participants_service import TournamentParticipantsService
+
+TOURNAMENT = "storm"
+TOURNAMENT_NAME = "Storm cup"
+HEADER = ["Nickname", "Phone", "Branch", "Teammates", "Discord", "Game", "Format", "Tournament", "Tournament name",
+          "Added"]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+
+    async def measure(self, name, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            self.latencies[name].append(time.perf_counter() - started)
+
+
+def approve_all(spreadsheet):
+    # The organiser ticks the "Added" checkbox directly in the sheet, which is not an API call of the bot
+    worksheet = spreadsheet.worksheets["USERS_DATABASE"]
+    with spreadsheet.lock:
+        for row in worksheet.rows[1:]:
+            if row and row[0] and "DELETED" not in row:
+                row += [""] * (len(HEADER) - len(row))
+                row[9] = "TRUE"
+
+
+async def sync_loop(service, recorder, spreadsheet, interval, done):
+    # The body of TournamentParticipantsService.run, timed tick by tick
+    priority.set(BACKGROUND)
+    while not done.is_set():
+        approve_all(spreadsheet)
+        await recorder.measure("sync_tick", service.sync())
+        try:
+            await asyncio.wait_for(done.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(args):
+    random.seed(args.seed)
+    directory = tempfile.mkdtemp(prefix="registration_storm_")
+    # Keeps StateStore from migrating a real roles.json when the harness runs inside a deployment
+    os.environ["ROLES_FILE"] = os.path.join(directory, "roles.json")
+    os.environ["ROSTER_MESSAGES_FILE"] = os.path.join(directory, "roster_messages.json")
+    discord = FakeDiscord(latency=args.discord_latency)
+    guild = FakeGuild(discord)
+    role = guild.add_role(TOURNAMENT_NAME)
+    confirmation_channel = guild.add_channel("storm-confirmation")
+    tournament_channel = guild.add_channel("storm-tournament")
+
+    challongeServer = FakeChallongeServer(latency=args.challonge_latency)
+    challongeServer.add_tournament(TOURNAMENT, TOURNAMENT_NAME)
+    await challongeServer.start()
+
+    spreadsheet = FakeSpreadsheet(rows=[HEADER], latency=args.sheets_latency)
+    stateStore = StateStore(os.path.join(directory, "state.db"))
+    stateStore.add_tournament(role.id, role.name, confirmation_channel.id, tournament_channel.id,
+                              guild_id=guild.id, challonge_id=TOURNAMENT)
+    googleSheetsManager = GoogleSheetsManager("fake", sheets=[spreadsheet])
+    sheetsWriteQueue = SheetsWriteQueue(googleSheetsManager, journal_path=os.path.join(directory, "journal.jsonl"))
+    registrationStore = RegistrationStore(googleSheetsManager, sheetsWriteQueue)
+    rosterManager = RosterManager(registrationStore, stateStore, debounce=args.roster_debounce)
+    challongeClient = ChallongeClient("bench", "bench", api_url=challongeServer.url)
+    challongeCache = ChallongeCache(challongeClient, stateStore)
+    service = TournamentParticipantsService(googleSheetsManager, challongeClient, challongeCache, stateStore)
+    nameIndex = GuildNameIndex()
+    interactionGuard = InteractionGuard()
+
+    await sheetsWriteQueue.start()
+    await registrationStore.load()
+    spreadsheet.calls.clear()
+
+    recorder = Recorder()
+    data = {"tournament_name": TOURNAMENT_NAME, "game": "FORTNITE", "form": FORMAT["1x1"], "tournament": TOURNAMENT}
+    members = [FakeMember(discord, f"player{i}") for i in range(args.users)]
+    cancelling = set(random.sample(range(args.users), int(args.users * args.cancel)))
+    double_clicking = set(random.sample(range(args.users), int(args.users * args.duplicates)))
+
+    async def submit(member):
+        modal = RegistrationModalOne(title="Registration from tournament", custom_id="registration_modal",
+                                     data=data, registrationStore=registrationStore, rosterManager=rosterManager,
+                                     nameIndex=nameIndex, interactionGuard=interactionGuard)
+        interaction = FakeInteraction(discord, member, confirmation_channel, custom_id="registration_modal",
+                                      text_values={"nickname": member.name, "phone": "+000", "branch": "Bench"})
+        await recorder.measure("registration", modal.callback(interaction))
+
+    async def user_session(index):
+        member = members[index]
+        await asyncio.sleep(random.uniform(0, args.spread))
+        await asyncio.gather(*(submit(member) for _ in range(2 if index in double_clicking else 1)))
+        if index in cancelling:
+            await asyncio.sleep(random.uniform(0, args.spread))
+            interaction = FakeInteraction(discord, member, confirmation_channel,
+                                          custom_id=f"cancel_button:{TOURNAMENT}")
+            await recorder.measure("cancel", cancel_registration(interaction, TOURNAMENT, stateStore,
+                                                                 registrationStore, rosterManager, nameIndex,
+                                                                 interactionGuard))
+
+    done = asyncio.Event()
+    started = time.perf_counter()
+    sync_task = asyncio.create_task(sync_loop(service, recorder, spreadsheet, args.sync_interval, done))
+    await asyncio.gather(*(user_session(index) for index in range(args.users)))
+    storm_seconds = time.perf_counter() - started
+
+    # Let the write-behind queue, the debounced roster edit and the participant sync catch up;
+    # like the service, the harness never runs two syncs at once
+    while sheetsWriteQueue.qsize():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(args.roster_debounce)
+    done.set()
+    await sync_task
+    expected = {member.name for index, member in enumerate(members) if index not in cancelling}
+    for _ in range(10):
+        approve_all(spreadsheet)
+        await recorder.measure("sync_tick", service.sync())
+        if {item["participant"]["name"] for item in challongeServer.tournaments[TOURNAMENT]["participants"]} \
+                == expected:
+            break
+    settled_seconds = time.perf_counter() - started
+
+    await sheetsWriteQueue.close()
+    await challongeClient.close()
+    await challongeServer.close()
+    stateStore.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    rows = [row for row in spreadsheet.worksheets["USERS_DATABASE"].rows[1:] if row and row[0]]
+    registered = {row[0] for row in rows if "DELETED" not in row}
+    in_challonge = [item["participant"]["name"] for item in challongeServer.tournaments[TOURNAMENT]["participants"]]
+    actions = args.users + len(double_clicking) + len(cancelling)
+
+    print(f"users: {args.users}  double clicks: {len(double_clicking)}  cancels: {len(cancelling)}  "
+          f"latency sheets/challonge/discord: {args.sheets_latency * 1000:.0f}/"
+          f"{args.challonge_latency * 1000:.0f}/{args.discord_latency * 1000:.0f} ms")
+    print(f"storm: {storm_seconds:.2f}s  settled: {settled_seconds:.2f}s")
+    print()
+    print(f"{'operation':<14}{'count':>7}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name in ("registration", "cancel", "sync_tick"):
+        values = recorder.latencies[name]
+        seconds = settled_seconds if name == "sync_tick" else storm_seconds
+        print(f"{name:<14}{len(values):>7}{len(values) / seconds:>10.1f}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{max(values, default=0) * 1000:>10.1f}")
+    print()
+    print(f"{'api calls':<36}{'total':>7}{'per action':>12}")
+    for upstream, calls in (("sheets", spreadsheet.calls), ("challonge", challongeServer.calls),
+                            ("discord", discord.calls)):
+        for name, count in sorted(calls.items()):
+            print(f"{upstream + ' ' + name:<36}{count:>7}{count / actions:>12.3f}")
+    print()
+    print(f"sheet rows: {len(rows)}  registered: {len(registered)}  challonge participants: {len(in_challonge)}  "
+          f"lost: {len(expected - registered)}  duplicates: {len(rows) - len({row[0] for row in rows})}  "
+          f"challonge mismatches: {len(expected.symmetric_difference(in_challonge))}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--cancel", type=float, default=0.2, help="share of users who cancel afterwards")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of users who submit twice at once")
+    parser.add_argument("--spread", type=float, default=1.0, help="seconds over which the storm arrives")
+    parser.add_argument("--sheets-latency", type=float, default=0.1)
+    parser.add_argument("--challonge-latency", type=float, default=0.05)
+    parser.add_argument("--discord-latency", type=float, default=0.03)
+    parser.add_argument("--sync-interval", type=float, default=0.5)
+    parser.add_argument("--roster-debounce", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,41 @@
+"""Counts Google Sheets API round trips per registration against an in-process fake spreadsheet.
+
+Run from the repository root: python -m benchmarks.sheets_api_calls
+"""
+import asyncio
+import os
+
+os.environ.setdefault("USERS_DATABASE_TABLE", "USERS_DATABASE!A2:J")
+# The fake spreadsheet has no quota, so the shared rate limits would only slow the run down
+os.environ.setdefault("SHEETS_READ_RATE", "1000")
+os.environ.setdefault("SHEETS_WRITE_RATE", "1000")
+
+from benchmarks.fakes import FakeSpreadsheet
+from google_sheets_manager_v2 import GoogleSheetsManager
+
+WRITE_QUOTA_PER_MINUTE = 60
+REGISTRATIONS = 50
+
+
+async def main():
+    spreadsheet = FakeSpreadsheet(rows=[["Nickname", "Phone", "Branch", "Teammates", "Discord", "Game", "Format",
+                                         "Tournament", "Tournament name", "Added"]])
+    manager = GoogleSheetsManager("fake", sheets=[spreadsheet])
+    manager.connections[0].worksheet("USERS_DATABASE")
+    spreadsheet.calls.clear()
+
+    for i in range(REGISTRATIONS):
+        await manager.add_new_user([f"player{i}", "+000", "Branch", "", f"discord{i}", "FORTNITE", "1x1",
+                                    "bench", "Bench cup"])
+
+    total = sum(spreadsheet.calls.values())
+    per_registration = total / REGISTRATIONS
+    print(f"registrations:              {REGISTRATIONS}")
+    print(f"api calls:                  {dict(spreadsheet.calls)}")
+    print(f"api calls per registration: {per_registration:.2f}")
+    print(f"registrations per minute within {WRITE_QUOTA_PER_MINUTE} writes/min quota: "
+          f"{WRITE_QUOTA_PER_MINUTE / per_registration:.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
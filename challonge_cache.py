@@ -0,0 +1,78 @@
+import asyncio
+import os
+from collections import Counter
+
+from cachetools import TLRUCache
+
+from logger import get_logger
+
+loggerChallongeCache = get_logger(os.path.basename(__file__))
+
+
+class ChallongeCache:
+    # Seconds a tournament entry stays fresh, by Challonge state
+    TOURNAMENT_TTL = {
+        "pending": 30,
+        "underway": 300,
+        "awaiting_review": 300,
+        "complete": 86400
+    }
+    DEFAULT_TOURNAMENT_TTL = 60
+
+    def __init__(self, challongeClient, stateStore=None, maxsize=None, participants_ttl=None):
+        self.challongeClient = challongeClient
+        self.stateStore = stateStore
+        maxsize = maxsize or int(os.getenv("CHALLONGE_CACHE_SIZE", 256))
+        self.participants_ttl = participants_ttl or int(os.getenv("CHALLONGE_PARTICIPANTS_TTL", 120))
+        self.tournaments = TLRUCache(maxsize, self._tournament_ttu)
+        self.participants = TLRUCache(maxsize, lambda key, value, now: now + self.participants_ttl)
+        self.complete_tournaments = stateStore.load_complete_tournaments() if stateStore else set()
+        self.hits = Counter()
+        self.misses = Counter()
+        self._inflight = {}
+
+    def _tournament_ttu(self, key, value, now):
+        state = value['tournament'].get('state')
+        return now + self.TOURNAMENT_TTL.get(state, self.DEFAULT_TOURNAMENT_TTL)
+
+    async def _get(self, name, cache, key, fetch):
+        value = cache.get(key)
+        if value is not None:
+            self.hits[name] += 1
+            return value
+
+        self.misses[name] += 1
+        # Concurrent misses for the same key share one request
+        task = self._inflight.get((name, key))
+        if task is None:
+            task = asyncio.ensure_future(fetch(key))
+            self._inflight[(name, key)] = task
+            task.add_done_callback(lambda _: self._inflight.pop((name, key), None))
+            value = await task
+            cache[key] = value
+            return value
+        return await task
+
+    async def get_tournament(self, tournament_id):
+        tournament_data = await self._get("tournament", self.tournaments, tournament_id,
+                                          self.challongeClient.get_tournament)
+        # Only "complete" is final; an underway tournament can still be reset and is re-checked through the TTL
+        if tournament_data['tournament']['state'] == "complete" and tournament_id not in self.complete_tournaments:
+            self.complete_tournaments.add(tournament_id)
+            if self.stateStore:
+                self.stateStore.add_complete_tournament(tournament_id)
+        return tournament_data
+
+    async def get_participants(self, tournament_id):
+        return await self._get("participants", self.participants, tournament_id,
+                               self.challongeClient.get_participants)
+
+    def is_complete(self, tournament_id):
+        return tournament_id in self.complete_tournaments
+
+    def stats(self):
+        return {
+            name: {"hits": self.hits[name], "misses": self.misses[name],
+                   "size": len(cache), "maxsize": cache.maxsize}
+            for name, cache in (("tournament", self.tournaments), ("participants", self.participants))
+        }
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from logger import get_logger
+import metrics
+from rate_limiter import governor, parse_retry_after
+
+loggerChallonge = get_logger(os.path.basename(__file__))
+
+
+class ChallongeClient:
+    DEFAULT_API_URL = "https://api.challonge.com/v1"
+    headers = {'User-Agent': 'Chrome'}
+
+    def __init__(self, username=None, password=None, api_url=None,
+                 max_connections=20, max_concurrency=5, timeout=15, max_retries=3):
+        self.username = username or os.getenv("CHALLONGE_LOGIN")
+        self.password = password or os.getenv("CHALLONGE_API_KEY")
+        self.api_url = (api_url or os.getenv("CHALLONGE_API_URL") or self.DEFAULT_API_URL).rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_retries = max_retries
+        # Keyed by account too: guilds with their own Challonge credentials do not share a rate limit
+        self.upstream = f"challonge:{self.username}@{urlparse(self.api_url).netloc}"
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  auth=aiohttp.BasicAuth(self.username or "", self.password or ""),
+                                                  headers=self.headers,
+                                                  timeout=self.timeout)
+        return self._session
+
+    async def request(self, method, path, timeout=None, **kwargs):
+        session = self._get_session()
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        for attempt in range(self.max_retries + 1):
+            await governor.acquire(self.upstream)
+            async with self._semaphore:
+                started = time.perf_counter()
+                status = None
+                try:
+                    async with session.request(method, f"{self.api_url}/{path}", **kwargs) as response:
+                        status = response.status
+                        loggerChallonge.debug("%s %s - %s", method, path, response.status)
+                        if response.status == 429 and attempt < self.max_retries:
+                            # The governor holds every Challonge call until the server's window has passed
+                            governor.penalize(self.upstream, parse_retry_after(response.headers, default=2 ** attempt))
+                            continue
+                        governor.update_from_headers(self.upstream, response.headers)
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+                except Exception as error:
+                    status = status or type(error).__name__
+                    raise
+                finally:
+                    metrics.upstream_latency.observe(time.perf_counter() - started, upstream="challonge", operation=method)
+                    metrics.upstream_requests.inc(upstream="challonge", operation=method, status=status)
+
+    async def get_tournament(self, tournament_id, timeout=None):
+        return await self.request("GET", f"tournaments/{tournament_id}.json", timeout=timeout)
+
+    async def get_participants(self, tournament_id, timeout=None):
+        response = await self.request("GET", f"tournaments/{tournament_id}/participants.json", timeout=timeout)
+        return [participant['participant'] for participant in response]
+
+    async def add_participant(self, tournament_id, name, timeout=None):
+        data = {
+            "participant": {
+                "name": name
+            }
+        }
+        response = await self.request("POST", f"tournaments/{tournament_id}/participants.json",
+                                      json=data, timeout=timeout)
+        return response['participant']
+
+    async def bulk_add_participants(self, tournament_id, names, timeout=None):
+        data = {
+            "participants": [{"name": name} for name in names]
+        }
+        response = await self.request("POST", f"tournaments/{tournament_id}/participants/bulk_add.json",
+                                      json=data, timeout=timeout)
+        return [participant['participant'] for participant in response]
+
+    async def delete_participant(self, tournament_id, participant_id, timeout=None):
+        return await self.request("DELETE", f"tournaments/{tournament_id}/participants/{participant_id}.json",
+                                  timeout=timeout)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,129 @@
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+
+import disnake
+
+from logger import get_logger
+import metrics
+from state_store import DATE_FORMAT
+from tournament_provisioning import discordPool
+
+loggerExpiry = get_logger(os.path.basename(__file__))
+
+
+class ExpiryScheduler:
+    def __init__(self, bot, stateStore, default_guild_id=None, lifetime=None, concurrency=None, retry_delay=60):
+        self.bot = bot
+        self.stateStore = stateStore
+        self.default_guild_id = default_guild_id
+        self.lifetime = lifetime or timedelta(days=int(os.getenv("TOURNAMENT_LIFETIME_DAYS", 7)))
+        self.retry_delay = retry_delay
+        self._semaphore = asyncio.Semaphore(concurrency or int(os.getenv("EXPIRY_CONCURRENCY", 3)))
+        self._heap = []
+        self._due = {}
+        self._attempts = {}
+        self._wakeup = asyncio.Event()
+        metrics.queue_depth.track(lambda: len(self._due), queue="role_expiry")
+
+    def owns(self, guild_id):
+        # Processes running different SHARD_IDS share the state database; each cleans up its own guilds only
+        guild_id = guild_id or self.default_guild_id
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        if not guild_id or not shard_ids:
+            return True
+        return (guild_id >> 22) % self.bot.shard_count in shard_ids
+
+    def load(self):
+        for tournament in self.stateStore.get_tournaments():
+            if not self.owns(tournament["guild_id"]):
+                continue
+            self.schedule(tournament["role_id"], datetime.strptime(tournament["creation_date"], DATE_FORMAT))
+        loggerExpiry.info(f"{len(self._due)} tournaments scheduled for cleanup")
+
+    def schedule(self, role_id, creation_date=None):
+        expires_at = (creation_date or datetime.now()) + self.lifetime
+        self._push(role_id, time.time() + (expires_at - datetime.now()).total_seconds())
+
+    def _push(self, role_id, due):
+        # Stale heap entries are skipped on pop by comparing against _due
+        self._due[role_id] = due
+        heapq.heappush(self._heap, (due, role_id))
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due = []
+            while self._heap and self._heap[0][0] <= time.time():
+                expires_at, role_id = heapq.heappop(self._heap)
+                if self._due.get(role_id) == expires_at:
+                    del self._due[role_id]
+                    due.append(role_id)
+            results = await asyncio.gather(*(self.expire(role_id) for role_id in due), return_exceptions=True)
+            for role_id, result in zip(due, results):
+                if isinstance(result, Exception):
+                    loggerExpiry.error(f"Cleanup of tournament {role_id} failed: {result}")
+                    self._retry(role_id)
+
+    async def _delete(self, resource, route, guild):
+        if resource is None:
+            return True
+        # The local semaphore keeps cleanup from taking every Discord worker the guild's /create calls need
+        async with self._semaphore:
+            try:
+                await discordPool.run(resource.delete(), route, guild.id)
+                return True
+            except disnake.NotFound:
+                return True
+            except Exception as error:
+                # Connection errors and timeouts are retried like HTTP errors
+                loggerExpiry.warning(f"Failed to delete {resource}: {error}")
+                return False
+
+    async def expire(self, role_id):
+        tournament = self.stateStore.get_tournament(role_id)
+        if tournament is None:
+            return
+
+        guild = self.bot.get_guild(tournament["guild_id"] or self.default_guild_id)
+        if guild is None:
+            loggerExpiry.warning(f"Guild for tournament '{tournament['role_name']}' is not available")
+            return self._retry(role_id)
+
+        results = await asyncio.gather(
+            self._delete(guild.get_channel(tournament["confirmation_channel_id"]), "delete_channel", guild),
+            self._delete(guild.get_channel(tournament["tournament_channel_id"]), "delete_channel", guild),
+            self._delete(guild.get_role(role_id), "delete_role", guild))
+
+        if all(results):
+            self.stateStore.delete_tournament(role_id)
+            self.stateStore.delete_roster_message(tournament["confirmation_channel_id"])
+            self._attempts.pop(role_id, None)
+            loggerExpiry.info(f"Роль '{tournament['role_name']}' удалена из сервера {guild.name}")
+        else:
+            self._retry(role_id)
+
+    def _retry(self, role_id):
+        attempts = self._attempts.get(role_id, 0) + 1
+        self._attempts[role_id] = attempts
+        delay = min(self.retry_delay * 2 ** (attempts - 1), 86400)
+        loggerExpiry.info(f"Cleanup of tournament {role_id} will be retried in {delay} seconds")
+        self._push(role_id, time.time() + delay)
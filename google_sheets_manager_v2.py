@@ -1,124 +1,279 @@
+import asyncio
+import itertools
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv, find_dotenv
 import gspread
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+from google.auth.exceptions import RefreshError
 from google.oauth2.service_account import Credentials
+from requests.exceptions import RequestException
 from logger import get_logger
-from gspread_formatting import *
+import metrics
+from rate_limiter import governor, parse_retry_after
+from registration_record import STATUS_COLUMN, RegistrationTable, RowParser
 
 load_dotenv(find_dotenv(), verbose=True, override=True)
 
 loggerSheet = get_logger(os.path.basename(__file__))
 
+CHECKBOX_VALIDATION = {"condition": {"type": "BOOLEAN"}, "showCustomUi": True}
+
+
+class SheetsConnection:
+    def __init__(self, name, sheet):
+        self.name = name
+        self.sheet = sheet
+        # Worksheet handles are bound to the account's client, so each connection keeps its own
+        self.worksheets = {}
+        self.failures = 0
+        self.unhealthy_until = 0
+
+    def worksheet(self, sheet_name):
+        worksheet = self.worksheets.get(sheet_name)
+        if worksheet is None:
+            worksheet = self.sheet.worksheet(sheet_name)
+            self.worksheets[sheet_name] = worksheet
+        return worksheet
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.unhealthy_until
+
+    def mark_failed(self, retry_after, max_backoff=300):
+        self.failures += 1
+        delay = retry_after if retry_after is not None else min(2 ** (self.failures - 1), max_backoff)
+        self.unhealthy_until = time.monotonic() + delay
+
+    def mark_ok(self):
+        self.failures = 0
+        self.unhealthy_until = 0
+
 
 class GoogleSheetsManager:
     SCOPES = [os.getenv('SCOPES')]
+    MAX_WORKERS = int(os.getenv("SHEETS_MAX_WORKERS", 4))
+    QUOTA_BACKOFF = float(os.getenv("SHEETS_QUOTA_BACKOFF", 10))
 
-    def __init__(self, spreadsheet_id):
+    def __init__(self, spreadsheet_id, sheets=None, users_table=None, name=None):
         self.spreadsheet_id = spreadsheet_id
-        self.sheet = None
+        self.users_table = users_table or os.getenv("USERS_DATABASE_TABLE")
+        # Prefixes the account names, and with them the rate-limit buckets, so every guild has its own quota
+        self.name = name
+        # Column layout found by the last read; appends use it so they land where reads look for them
+        self.layout = None
+        self.connections = []
+        self._cursor = itertools.count()
+        # Serialises operations that depend on row positions (status lookups and their updates)
+        self.rows_lock = asyncio.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS, thread_name_prefix="sheets")
+        self._health_gauge = metrics.gauge("sheets_account_healthy",
+                                           "Whether a Google Sheets service account is taking requests")
+        self._health_collector = self._health_gauge.collect(
+            lambda: [({"account": connection.name}, int(connection.healthy)) for connection in self.connections])
+        if sheets is not None:
+            self.connections = [SheetsConnection(self._connection_name(f"sheet{index}"), sheet)
+                                for index, sheet in enumerate(sheets)]
+            return
+
         service_account_files = [os.getenv('SHEET_SERVICE_ACCOUNT_FILE'),
                                  os.getenv('SHEET_SERVICE_ACCOUNT_FILE_RESERVE')]
+        service_account_files += os.getenv('SHEET_SERVICE_ACCOUNT_FILES', "").split(",")
 
-        for file in service_account_files:
+        for file in dict.fromkeys(file.strip() for file in service_account_files if file and file.strip()):
             try:
                 loggerSheet.info(f"Attempting connection with {file}")
                 creds = Credentials.from_service_account_file(file,
                                                               scopes=self.SCOPES)
                 client = gspread.authorize(creds)
-                self.sheet = client.open_by_key(spreadsheet_id)
-                loggerSheet.info("Connection to Google Sheets was successful")
-                break
+                name = self._connection_name(os.path.splitext(os.path.basename(file))[0])
+                self.connections.append(SheetsConnection(name, client.open_by_key(spreadsheet_id)))
+                loggerSheet.info(f"Connection to Google Sheets with {file} was successful")
             except Exception as error:
                 loggerSheet.error(f'An error occurred with {file}: {error}')
                 continue
 
-        if self.sheet is None:
+        if not self.connections:
             loggerSheet.critical("Failed to connect to any service account")
 
-    async def write_data(self, range_name, values):
-        sheet_name, cell_range = range_name.split('!')
-        worksheet = self.sheet.worksheet(sheet_name)
-        cell_list = worksheet.range(cell_range)
+    def close(self):
+        self._health_gauge.remove(self._health_collector)
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
-        for i, cell in enumerate(cell_list):
-            cell.value = values[i]
+    def _connection_name(self, account):
+        return f"{self.name}:{account}" if self.name else account
 
-        worksheet.update_cells(cell_list)
+    def _ordered_connections(self):
+        # Round robin over healthy accounts; unhealthy ones are tried last, soonest to recover first
+        start = next(self._cursor) % len(self.connections)
+        ordered = self.connections[start:] + self.connections[:start]
+        return [connection for connection in ordered if connection.healthy] + \
+            sorted((connection for connection in ordered if not connection.healthy),
+                   key=lambda connection: connection.unhealthy_until)
 
-        validation_rule = DataValidationRule(
-            BooleanCondition('BOOLEAN', ['TRUE', 'FALSE']),
-            showCustomUi=True)
-        set_data_validation_for_cell_range(worksheet, f"J{cell_list[-1].row}", validation_rule)
+    async def _run(self, upstreams, func, *args, **kwargs):
+        if not self.connections:
+            raise ConnectionError("No Google Sheets service account is connected")
+        upstreams = (upstreams,) if isinstance(upstreams, str) else upstreams
+        loop = asyncio.get_running_loop()
+        connections = self._ordered_connections()
 
-    def get_item_by_field(self, value):
-        all_values = self.get_users_data(os.getenv("USERS_DATABASE_TABLE"))
-        matching_rows = []
+        for attempt, connection in enumerate(connections):
+            for upstream in upstreams:
+                await governor.acquire(f"{upstream}:{connection.name}")
+            operation = func.__name__.lstrip("_")
+            started = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self.executor, partial(func, connection, *args, **kwargs))
+            except Exception as error:
+                status = metrics.status_code(error)
+                self._record(operation, connection, started, metrics.status_of(error))
+                retry_after = None
+                if status == 429:
+                    retry_after = parse_retry_after(getattr(getattr(error, "response", None), "headers", None),
+                                                    default=self.QUOTA_BACKOFF)
+                    # Hold back every caller of this account's quota instead of letting each of them hit the limit
+                    for upstream in upstreams:
+                        governor.penalize(f"{upstream}:{connection.name}", retry_after)
+                connection.mark_failed(retry_after)
 
-        for row in all_values:
-            if value in row:
-                matching_rows.append(row)
+                # Quota and credential errors mean the request was not applied, so another account can repeat it;
+                # other failures are only repeated for reads
+                failover = status in (401, 403, 429) or isinstance(error, RefreshError) or (
+                    "sheets_write" not in upstreams and (status is None or status >= 500)
+                    and isinstance(error, (RequestException, ConnectionError, TimeoutError, gspread.exceptions.APIError)))
+                if not failover or attempt == len(connections) - 1:
+                    raise
+                loggerSheet.warning(f"Account {connection.name} failed ({status or error}), "
+                                    f"retrying with {connections[attempt + 1].name}")
+                continue
 
-        return matching_rows
+            self._record(operation, connection, started, "ok")
+            connection.mark_ok()
+            return result
 
-    async def append_to_first_empty_row(self, values):
-        sheet_name = os.getenv("USERS_DATABASE_TABLE").split("!")[0]
-        worksheet = self.sheet.worksheet(sheet_name)
+    @staticmethod
+    def _record(operation, connection, started, status):
+        metrics.upstream_latency.observe(time.perf_counter() - started, upstream="sheets", operation=operation)
+        metrics.upstream_requests.inc(upstream="sheets", operation=operation, status=status)
+
+    def _read_rows(self, connection, range_data):
+        # The header row above the range comes back in the same call and locates the columns by name
+        sheet_name, cell_range = range_data.split('!')
+        worksheet = connection.worksheet(sheet_name)
+        start, _, end = cell_range.partition(':')
+        first_row, first_column = a1_to_rowcol(start)
+        if first_row == 1:
+            parser, rows = RowParser(), worksheet.get(cell_range)
+        else:
+            values = worksheet.get(f"{rowcol_to_a1(first_row - 1, first_column)}:{end}" if end
+                                   else rowcol_to_a1(first_row - 1, first_column))
+            parser, rows = RowParser.from_header(values[0] if values else []), values[1:]
+        self.layout = (parser, first_column)
+        return worksheet, parser, rows, first_row, first_column
 
-        col_values = worksheet.col_values(1)
-        first_empty_row = len(col_values) + 1
-        for index, item in enumerate(col_values, start=1):
-            if item == '':
-                first_empty_row = index
+    def _apply_writes(self, connection, appends, statuses):
+        worksheet = connection.worksheet(self.users_table.split("!")[0])
+        requests = []
+        updated = 0
 
-        await self.write_data(f"{sheet_name}!A{first_empty_row}:I{first_empty_row}", values)
+        if statuses:
+            # Row numbers are resolved against the raw range so that filtered rows do not shift them
+            worksheet, parser, rows, first_row, first_column = self._read_rows(connection, self.users_table)
+            status_column = first_column - 1 + parser.column("status")
+            columns = RegistrationTable.parse(rows, parser).columns
+            for index, key in enumerate(zip(columns["tournament"], columns["discord"])):
+                status = statuses.get(key)
+                if status is None or columns["status"][index].value == status:
+                    continue
+                requests.append({
+                    "updateCells": {
+                        "start": {"sheetId": worksheet.id, "rowIndex": first_row - 1 + index,
+                                  "columnIndex": status_column},
+                        "rows": [{"values": [to_cell_data(status, checkbox=True)]}],
+                        "fields": "userEnteredValue"
+                    }
+                })
+                updated += 1
+
+        if appends:
+            if self.layout is None:
+                self._read_rows(connection, self.users_table)
+            parser, first_column = self.layout
+            # appendCells writes after the last row with data, so no column scan is needed
+            requests.append({
+                "appendCells": {
+                    "sheetId": worksheet.id,
+                    "rows": [to_row_data(values, parser, first_column) for values in appends],
+                    "fields": "userEnteredValue,dataValidation"
+                }
+            })
+
+        if requests:
+            connection.sheet.batch_update({"requests": requests})
+        return updated
+
+    async def apply_writes(self, appends, statuses):
+        if not statuses:
+            return await self._run("sheets_write", self._apply_writes, appends, statuses)
+        async with self.rows_lock:
+            # Status changes read the range before writing, so they use both quotas
+            return await self._run(("sheets_read", "sheets_write"), self._apply_writes, appends, statuses)
+
+    def _append_to_first_empty_row(self, connection, values):
+        self._apply_writes(connection, [values], {})
         loggerSheet.debug("New row has been added to the first empty row of the table")
 
-    def get_users_data(self, range_data):
+    async def append_to_first_empty_row(self, values):
+        await self._run("sheets_write", self._append_to_first_empty_row, values)
+
+    def _get_registrations(self, connection, range_data):
         loggerSheet.debug("Getting user data")
-        sheet_name, cell_range = range_data.split('!')
-        worksheet = self.sheet.worksheet(sheet_name)
-        values = worksheet.get(cell_range)
+        _, parser, rows, _, _ = self._read_rows(connection, range_data)
+        # Rows are parsed here, on the executor thread, once per fetch
+        return RegistrationTable.parse(rows, parser)
 
-        if not values:
-            loggerSheet.debug("No data found")
-        else:
-            loggerSheet.debug("Data received successfully")
-            filtered_items = get_filtered_data(values)
-            return filtered_items
+    async def get_registrations(self, range_data):
+        return await self._run("sheets_read", self._get_registrations, range_data)
+
+    async def get_users_data(self, range_data):
+        table = await self.get_registrations(range_data)
+        return [record.to_values() for record in table.select()]
 
     async def add_new_user(self, user_data):
         loggerSheet.debug("Adding a new user")
         await self.append_to_first_empty_row(user_data)
         loggerSheet.debug("User added successfully")
 
+    def _set_deleted_from_tournament(self, connection, discord, tournament):
+        return self._apply_writes(connection, [], {(tournament, discord): "DELETED"}) > 0
+
     async def set_deleted_from_tournament(self, discord, tournament):
-        values = self.get_users_data(os.getenv("USERS_DATABASE_TABLE"))
-        sheet_name = os.getenv("USERS_DATABASE_TABLE").split("!")[0]
-        for index, row in enumerate(values):
-            if row and row[7] == tournament and row[4] == discord:
-                row[9] = "DELETED"
-                await self.write_data(f"{sheet_name}!A{index + 2}:J{index + 2}", row)
-                return True
-        return False
-
-    def delete_row(self, row_index):
-        sheet_name = os.getenv("USERS_DATABASE_TABLE").split("!")[0]
-        worksheet = self.sheet.worksheet(sheet_name)
-        worksheet.delete_rows(row_index)
-        loggerSheet.debug(f"Row {row_index} has been deleted from the table")
-
-
-def get_filtered_data(values):
-    filtered_data = []
-    for item in values:
-        if "DELETED" in item:
-            continue
-        if item[0] == '':
-            continue
-        filtered_data.append(item)
-    return filtered_data
+        async with self.rows_lock:
+            return await self._run(("sheets_read", "sheets_write"), self._set_deleted_from_tournament,
+                                   discord, tournament)
+
+
+def to_cell_data(value, checkbox=False):
+    if checkbox and value in ("TRUE", "FALSE"):
+        return {"userEnteredValue": {"boolValue": value == "TRUE"}}
+    return {"userEnteredValue": {"stringValue": "" if value is None else str(value)}}
+
+
+def to_row_data(values, parser=None, first_column=1):
+    # Values come in Registration field order and go to the columns the parser reads them from
+    parser = parser or RowParser()
+    offset = first_column - 1
+    cells = [{"userEnteredValue": {"stringValue": ""}} for _ in range(offset + parser.width)]
+    for field, column in enumerate(parser.columns):
+        value = values[field] if field < len(values) else ""
+        cells[offset + column] = to_cell_data(value, checkbox=field == STATUS_COLUMN)
+    cells[offset + parser.column("status")]["dataValidation"] = CHECKBOX_VALIDATION
+    return {"values": cells}
 
 
 if __name__ == '__main__':
     googleSheetManager = GoogleSheetsManager(os.getenv("SHEET_ID"))
-    values = googleSheetManager.get_users_data(os.getenv("USERS_DATABASE_TABLE"))
+    values = asyncio.run(googleSheetManager.get_users_data(os.getenv("USERS_DATABASE_TABLE")))
@@ -0,0 +1,155 @@
+import asyncio
+import os
+
+from challonge_cache import ChallongeCache
+from challonge_client import ChallongeClient
+from google_sheets_manager_v2 import GoogleSheetsManager
+from logger import get_logger
+from registration_store import RegistrationStore
+from roster_manager import RosterManager
+from sheets_write_queue import SheetsWriteQueue
+from state_store import DEFAULT_GUILD_ID
+from tournament_participants_service import TournamentParticipantsService
+
+loggerGuilds = get_logger(os.path.basename(__file__))
+
+
+def journal_path(guild_id):
+    path = os.getenv("SHEETS_JOURNAL_PATH", "sheets_journal.jsonl")
+    # The default guild keeps the journal it used as the only guild, so queued writes survive the upgrade
+    if guild_id == DEFAULT_GUILD_ID:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{guild_id}{extension}"
+
+
+async def create_clients(config):
+    # Opening the spreadsheet authorises every service account with blocking calls
+    googleSheetsManager = await asyncio.to_thread(GoogleSheetsManager, config["sheet_id"],
+                                                  users_table=config["users_table"],
+                                                  name=f"guild{config['guild_id']}")
+    challongeClient = ChallongeClient(config["challonge_login"], config["challonge_api_key"],
+                                      api_url=config["challonge_api_url"])
+    return googleSheetsManager, challongeClient
+
+
+class GuildContext:
+    """Everything that talks to one guild's spreadsheet and Challonge account."""
+
+    def __init__(self, guild_id, stateStore, googleSheetsManager, challongeClient):
+        self.guild_id = guild_id
+        self.googleSheetsManager = googleSheetsManager
+        self.challongeClient = challongeClient
+        self.challongeCache = ChallongeCache(challongeClient, stateStore)
+        self.sheetsWriteQueue = SheetsWriteQueue(googleSheetsManager, journal_path=journal_path(guild_id),
+                                                 name=f"sheets_write:{guild_id}")
+        self.registrationStore = RegistrationStore(googleSheetsManager, self.sheetsWriteQueue)
+        self.rosterManager = RosterManager(self.registrationStore, stateStore)
+        self.tournamentParticipantsService = TournamentParticipantsService(
+            googleSheetsManager, challongeClient, self.challongeCache, stateStore, guild_id=guild_id)
+        self.refresh_task = None
+        self.service_task = None
+
+    async def start(self, embedded_service=False):
+        await self.sheetsWriteQueue.start()
+        await self.registrationStore.load()
+        self.refresh_task = asyncio.create_task(self.registrationStore.run_refresh())
+        if embedded_service:
+            # Sync with Challonge as soon as a registration reaches the sheet instead of waiting for the next poll
+            self.sheetsWriteQueue.listeners.append(self.tournamentParticipantsService.notify)
+            self.service_task = asyncio.create_task(self.tournamentParticipantsService.run())
+
+    async def close(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+        # The service finishes the sync it is in the middle of
+        self.tournamentParticipantsService.stop()
+        if self.service_task is not None:
+            await self.service_task
+        await self.sheetsWriteQueue.close()
+        await self.challongeClient.close()
+        self.googleSheetsManager.close()
+
+
+class GuildRegistry:
+    def __init__(self, stateStore, embedded_service=None, retry_delay=30, max_retry_delay=1800):
+        self.stateStore = stateStore
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        if embedded_service is None:
+            embedded_service = os.getenv("PARTICIPANT_SERVICE_EMBEDDED", "FALSE").upper() == "TRUE"
+        self.embedded_service = embedded_service
+        self.contexts = {}
+        self._starting = {}
+        self._attempts = {}
+        self._retries = {}
+
+    def get(self, guild_id):
+        return self.contexts.get(guild_id)
+
+    def guild_ids(self):
+        return [config["guild_id"] for config in self.stateStore.get_guild_configs()]
+
+    async def start(self, guild_id):
+        if guild_id in self.contexts:
+            return self.contexts[guild_id]
+        # on_ready and on_guild_join can race for the same guild; both wait for one start
+        task = self._starting.get(guild_id)
+        if task is None:
+            task = self._starting[guild_id] = asyncio.ensure_future(self._start(guild_id))
+            task.add_done_callback(lambda _: self._starting.pop(guild_id, None))
+        return await asyncio.shield(task)
+
+    async def _start(self, guild_id):
+        config = self.stateStore.get_guild_config(guild_id)
+        if config is None:
+            loggerGuilds.info(f"Guild {guild_id} has no configuration, tournaments are disabled there")
+            return None
+
+        context = None
+        try:
+            googleSheetsManager, challongeClient = await create_clients(config)
+            context = GuildContext(guild_id, self.stateStore, googleSheetsManager, challongeClient)
+            await context.start(self.embedded_service)
+        except Exception as error:
+            if context is not None:
+                await context.close()
+            delay = self._retry(guild_id)
+            loggerGuilds.error(f"Guild {guild_id} could not be started, retrying in {delay} seconds: {error}")
+            return None
+        self._cancel_retry(guild_id)
+        self.contexts[guild_id] = context
+        loggerGuilds.info(f"Guild {guild_id} is ready")
+        return context
+
+    def _retry(self, guild_id):
+        attempts = self._attempts.get(guild_id, 0) + 1
+        self._attempts[guild_id] = attempts
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        retry = self._retries.pop(guild_id, None)
+        if retry is not None:
+            retry.cancel()
+        self._retries[guild_id] = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.ensure_future(self.start(guild_id)))
+        return delay
+
+    def _cancel_retry(self, guild_id):
+        retry = self._retries.pop(guild_id, None)
+        if retry is not None:
+            retry.cancel()
+        self._attempts.pop(guild_id, None)
+
+    async def start_all(self, guild_ids):
+        await asyncio.gather(*(self.start(guild_id) for guild_id in guild_ids))
+
+    async def stop(self, guild_id):
+        self._cancel_retry(guild_id)
+        context = self.contexts.pop(guild_id, None)
+        if context is not None:
+            await context.close()
+
+    async def close(self):
+        for guild_id in list(self._retries):
+            self._cancel_retry(guild_id)
+        contexts, self.contexts = list(self.contexts.values()), {}
+        await asyncio.gather(*(context.close() for context in contexts), return_exceptions=True)
@@ -0,0 +1,108 @@
+import os
+
+import disnake
+
+from logger import get_logger
+import metrics
+
+loggerRouter = get_logger(os.path.basename(__file__))
+
+
+class ComponentRouter:
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, prefix, *converters):
+        def decorator(handler):
+            self.routes[prefix] = (handler, converters)
+            return handler
+        return decorator
+
+    async def dispatch(self, inter):
+        prefix, _, arguments = inter.data.custom_id.partition(":")
+        route = self.routes.get(prefix)
+        if route is None:
+            return False
+
+        handler, converters = route
+        parts = arguments.split(":", len(converters) - 1) if converters else []
+        try:
+            if len(parts) != len(converters):
+                raise ValueError(f"expected {len(converters)} arguments, got {len(parts)}")
+            args = [convert(part) for convert, part in zip(converters, parts)]
+        except ValueError as error:
+            loggerRouter.warning(f"Malformed custom_id '{inter.data.custom_id}': {error}")
+            return False
+
+        with metrics.interaction_latency.time(handler=prefix):
+            await handler(inter, *args)
+        return True
+
+
+class GuildNameIndex:
+    """Per-guild name -> role/channel lookup kept current from gateway events."""
+
+    def __init__(self):
+        self._guilds = {}
+
+    def attach(self, bot):
+        bot.add_listener(self._on_create, "on_guild_role_create")
+        bot.add_listener(self._on_delete, "on_guild_role_delete")
+        bot.add_listener(self._on_update, "on_guild_role_update")
+        bot.add_listener(self._on_create, "on_guild_channel_create")
+        bot.add_listener(self._on_delete, "on_guild_channel_delete")
+        bot.add_listener(self._on_update, "on_guild_channel_update")
+        bot.add_listener(self._on_guild_remove, "on_guild_remove")
+
+    def _index(self, guild):
+        index = self._guilds.get(guild.id)
+        if index is None:
+            index = {"roles": {}, "channels": {}}
+            for role in guild.roles:
+                index["roles"].setdefault(role.name, {})[role.id] = role
+            for channel in guild.channels:
+                index["channels"].setdefault(channel.name, {})[channel.id] = channel
+            self._guilds[guild.id] = index
+        return index
+
+    @staticmethod
+    def _kind(item):
+        return "roles" if isinstance(item, disnake.Role) else "channels"
+
+    def add(self, item):
+        if item.guild.id in self._guilds:
+            self._guilds[item.guild.id][self._kind(item)].setdefault(item.name, {})[item.id] = item
+
+    def remove(self, item):
+        index = self._guilds.get(item.guild.id)
+        if index is None:
+            return
+        names = index[self._kind(item)]
+        items = names.get(item.name)
+        if items is not None:
+            items.pop(item.id, None)
+            if not items:
+                del names[item.name]
+
+    def get(self, guild, kind, name):
+        items = self._index(guild)[kind].get(name)
+        return next(iter(items.values()), None) if items else None
+
+    def get_role(self, guild, name):
+        return self.get(guild, "roles", name)
+
+    def get_channel(self, guild, name):
+        return self.get(guild, "channels", name)
+
+    async def _on_create(self, item):
+        self.add(item)
+
+    async def _on_delete(self, item):
+        self.remove(item)
+
+    async def _on_update(self, before, after):
+        self.remove(before)
+        self.add(after)
+
+    async def _on_guild_remove(self, guild):
+        self._guilds.pop(guild.id, None)
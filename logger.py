@@ -1,10 +1,22 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
 import sys
-from logging.handlers import TimedRotatingFileHandler, RotatingFileHandler
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from dotenv import load_dotenv, find_dotenv
+
+# Modules create their loggers at import time, before anything else has had a chance to read .env
+load_dotenv(find_dotenv())
 
 LOG_DIR = 'logs'
 LOG_FILE_PATH = os.path.join(LOG_DIR, 'application.log')
+LOG_LEVEL = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper())
 
 os.makedirs(LOG_DIR, exist_ok=True)
 
@@ -12,24 +24,103 @@ time_format = "%Y-%m-%d %H:%M:%S"
 FORMATTER = logging.Formatter(fmt='%(asctime)s — %(filename)s — %(lineno)d — %(levelname)s — %(message)s', datefmt=time_format)
 
 
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, time_format),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most `limit` records per call site through every `window` seconds at or below `level`."""
+
+    def __init__(self, limit, window, level=logging.DEBUG):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.level = level
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level or self.limit <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            started, passed, suppressed = self.sites.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, passed = now, 0
+            if passed >= self.limit:
+                self.sites[key] = (started, passed, suppressed + 1)
+                return False
+            self.sites[key] = (started, passed + 1, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class LocalQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The queue never leaves the process, so the listener formats the exception itself
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def get_formatter():
+    return JsonFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else FORMATTER
+
+
 def get_console_handler():
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(FORMATTER)
-    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(get_formatter())
+    console_handler.setLevel(LOG_LEVEL)
     return console_handler
 
 
 def get_file_handler():
     file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=1024*1024*5, backupCount=5, encoding='utf-8')
-    file_handler.setFormatter(FORMATTER)
-    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(get_formatter())
+    file_handler.setLevel(LOG_LEVEL)
     return file_handler
 
 
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+def get_queue_handler():
+    # Console and file I/O happen on one listener thread per process; callers only enqueue the record
+    global _queue_handler
+    with _setup_lock:
+        if _queue_handler is None:
+            records = queue.SimpleQueue()
+            listener = QueueListener(records, get_console_handler(), get_file_handler(), respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            _queue_handler = LocalQueueHandler(records)
+            _queue_handler.addFilter(RateLimitFilter(int(os.getenv("LOG_RATE_LIMIT", 10)),
+                                                     float(os.getenv("LOG_RATE_WINDOW", 60))))
+        return _queue_handler
+
+
 def get_logger(logger_name):
     logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(get_console_handler())
-    logger.addHandler(get_file_handler())
+    # Below LOG_LEVEL, logger.debug() returns before a record is even created
+    logger.setLevel(LOG_LEVEL)
+    handler = get_queue_handler()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
     logger.propagate = False
     return logger
@@ -1,33 +1,86 @@
 import asyncio
-import json
 import os
-from datetime import datetime, timedelta
-
-import requests
+import signal
 import disnake
-from disnake import PermissionOverwrite
 from disnake.ext import commands
-from disnake.ui import Button, View
 from choices_list import *
-from google_sheets_manager_v2 import GoogleSheetsManager
-from modals.registration_modal import RegistrationModalOne, messages_cache, clear_messages
+from expiry_scheduler import ExpiryScheduler
+from guild_registry import GuildRegistry
+from interaction_router import ComponentRouter, GuildNameIndex
+from logger import get_logger
+import metrics
+from registration_cancel import cancel_registration
+from state_store import DEFAULT_GUILD_ID, StateStore
+from throttling import InteractionGuard
+from tournament_provisioning import BatchProgress, ProvisioningError, parse_batch_csv, provision_batch, \
+    provision_tournament
+from modals.registration_modal import RegistrationModalOne
+
+loggerMain = get_logger(os.path.basename(__file__))
 
 TOKEN = os.getenv("DISCORD_TOKEN")
-googleSheetsManager = GoogleSheetsManager(os.getenv("SHEET_ID"))
+stateStore = StateStore()
+guildRegistry = GuildRegistry(stateStore)
+if not guildRegistry.guild_ids():
+    loggerMain.critical("No guild is configured: set SHEET_ID (with GUILD_ID) or list the guilds in GUILDS_FILE")
+    raise SystemExit(1)
+started = False
+metricsServer = metrics.MetricsServer() if os.getenv("METRICS_ENABLED", "TRUE").upper() == "TRUE" else None
 
 intents = disnake.Intents.default()
 intents.message_content = True
 
-# guild_id = 1159429797835976776
-guild_id = 1251650828519870532
-bot = commands.InteractionBot(intents=intents, test_guilds=[guild_id])
+# Several processes can split the shards between them: SHARD_COUNT=4 with SHARD_IDS=0,1 and SHARD_IDS=2,3
+shard_count = int(os.getenv("SHARD_COUNT") or 0) or None
+shard_ids = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()] or None
+bot = commands.AutoShardedInteractionBot(intents=intents, test_guilds=guildRegistry.guild_ids(),
+                                         shard_count=shard_count, shard_ids=shard_ids)
+expiryScheduler = ExpiryScheduler(bot, stateStore, default_guild_id=DEFAULT_GUILD_ID)
+componentRouter = ComponentRouter()
+nameIndex = GuildNameIndex()
+interactionGuard = InteractionGuard()
+nameIndex.attach(bot)
 
 
 @bot.event
 async def on_ready():
-    print("The bot is ready!")
+    global started
+    loggerMain.info(f"The bot is ready on {len(bot.guilds)} guilds!")
     loop = asyncio.get_event_loop()
-    loop.create_task(schedule_remove_old_roles())
+    if not started:
+        started = True
+        expiryScheduler.load()
+        loop.create_task(expiryScheduler.run())
+    # Only the guilds on this process's shards are started; the others belong to other processes
+    await guildRegistry.start_all([guild.id for guild in bot.guilds])
+    if metricsServer is not None and metricsServer.runner is None:
+        await start_metrics(metricsServer)
+
+
+async def start_metrics(server):
+    # A busy METRICS_PORT (several processes on one host) must not keep the bot from working
+    try:
+        await server.start()
+    except Exception as error:
+        loggerMain.error(f"Metrics server could not be started on port {server.port}: {error}")
+        await server.close()
+
+
+@bot.event
+async def on_guild_join(guild):
+    await guildRegistry.start(guild.id)
+
+
+@bot.event
+async def on_guild_remove(guild):
+    await guildRegistry.stop(guild.id)
+
+
+async def get_guild_context(inter):
+    context = guildRegistry.get(inter.guild_id)
+    if context is None:
+        await inter.response.send_message("Tournaments are not set up on this server.", ephemeral=True)
+    return context
 
 
 @bot.slash_command(
@@ -63,124 +116,119 @@ async def create(
 
     """
 
-    guild = inter.guild
+    with metrics.interaction_latency.time(handler="create"):
+        context = await get_guild_context(inter)
+        if context is None:
+            return
+        guild = inter.guild
 
-    tournament_channel = prefix + "-tournament"
-    confirmation_channel = prefix + "-confirmation"
+        tournament_channel = prefix + "-tournament"
 
-    existing_channel = disnake.utils.get(guild.channels, name=tournament_channel)
-    category = inter.channel.category
+        existing_channel = nameIndex.get_channel(guild, tournament_channel)
+        category = inter.channel.category
 
-    if existing_channel:
-        await inter.response.send_message(f"A channel with the name '{tournament_channel}' already exists.",
-                                          ephemeral=True)
-    else:
-        username = os.getenv("CHALLONGE_LOGIN")
-        password = os.getenv("CHALLONGE_API_KEY")
-        headers = {'User-Agent': 'Chrome'}
+        if existing_channel:
+            await inter.response.send_message(f"A channel with the name '{tournament_channel}' already exists.",
+                                              ephemeral=True)
+        else:
+            await inter.response.defer(ephemeral=True)
 
-        response = requests.get(f"https://api.challonge.com/v1/tournaments/{tournament}.json",
-                                auth=(username, password), headers=headers).json()
-        tournament_name = response["tournament"]["name"]
-
-        new_confirmation_channel = await guild.create_text_channel(name=confirmation_channel, category=category)
-
-        await inter.response.send_message(f"Channel '{new_confirmation_channel.name}' created successfully!",
-                                          ephemeral=True)
+            try:
+                new_role, new_confirmation_channel, new_tournament_channel = await provision_tournament(
+                    guild, category, prefix, tournament, date, game, form, context.challongeCache)
+            except ProvisioningError as error:
+                return await inter.edit_original_message(content=f"Failed to create the tournament: {error}")
 
-        new_role = await guild.create_role(name=tournament_channel)
+            record_tournament(guild, tournament, new_role, new_confirmation_channel, new_tournament_channel)
 
-        overwrites = {
-            guild.default_role: PermissionOverwrite(read_messages=False),
-            new_role: PermissionOverwrite(read_messages=True)
-        }
+            await inter.edit_original_message(
+                content=f"Channel '{new_confirmation_channel.name}' created successfully!")
 
-        new_tournament_channel = await guild.create_text_channel(name=tournament_channel, category=category)
-        await new_tournament_channel.edit(sync_permissions=True, overwrites=overwrites)
 
-        add_role_to_json(new_role, new_confirmation_channel.id, new_tournament_channel.id)
+@commands.default_member_permissions(manage_guild=True)
+@bot.slash_command(
+    name="create_batch",
+    description="Create several tournaments from a CSV file"
+)
+async def create_batch(inter: disnake.ApplicationCommandInteraction, file: disnake.Attachment):
+    """
+      Create several game tournaments at once.
 
-        register_button = Button(label="Confirm", style=disnake.ButtonStyle.green,
-                                 custom_id=f"registration_button:{tournament_channel}:{tournament}:{game}:{form}")
+      Parameters
+      ----------
+      file: CSV file with the columns prefix, tournament, date, game, form
 
-        cancel_button = Button(label="Cancel", style=disnake.ButtonStyle.red,
-                               custom_id=f"cancel_button:{tournament}")
+    """
 
-        view = View()
-        view.add_item(register_button)
-        view.add_item(cancel_button)
+    context = await get_guild_context(inter)
+    if context is None:
+        return
+    await inter.response.defer(ephemeral=True)
 
-        embed = disnake.Embed(
-            description=f'Welcome to the **True Gamers server**! This is to confirm your participation in the '
-                        f'**{tournament_name}** tournament that will be held on **{date}**.',
-            color=7339915
-        )
+    try:
+        rows = parse_batch_csv(await file.read())
+    except (ValueError, UnicodeDecodeError) as error:
+        return await inter.edit_original_message(content=f"Invalid batch file: {error}")
 
-        embed.set_footer(text='To confirm your participation, click on the "Confirm" button and fill out the form. '
-                              'We will be waiting for you at our computer club branches.')
-        await new_confirmation_channel.edit(sync_permissions=True)
-        await new_confirmation_channel.set_permissions(guild.default_role, send_messages=False)
+    guild = inter.guild
+    progress = BatchProgress(rows)
+    batch = asyncio.ensure_future(provision_batch(
+        guild, inter.channel.category, rows, context.challongeCache, nameIndex,
+        lambda row, *resources: record_tournament(guild, row["tournament"], *resources), progress))
 
-        await new_confirmation_channel.send(view=view, embed=embed)
+    # A single progress message is edited at most once a second while the batch runs
+    while not batch.done():
+        await inter.edit_original_message(content=progress.render())
+        await asyncio.wait({batch}, timeout=1)
+    await batch
+    await inter.edit_original_message(content=progress.render())
 
-        embed = disnake.Embed(
-            title='Hello, True Gamer!',
-            description=f'There is a conversation about the tournament that will take place {prefix}.',
-            color=7339915
-        )
 
-        await new_tournament_channel.send(embed=embed)
+def record_tournament(guild, tournament, new_role, new_confirmation_channel, new_tournament_channel):
+    stateStore.add_tournament(new_role.id, new_role.name, new_confirmation_channel.id, new_tournament_channel.id,
+                              guild_id=guild.id, challonge_id=tournament)
+    expiryScheduler.schedule(new_role.id)
 
 
 @bot.event
 async def on_interaction(inter):
     if isinstance(inter, disnake.MessageInteraction):
-        custom_id = inter.data.custom_id
-        parts = custom_id.split(":")
-        if parts[0] == "registration_button":
-            name, tournament, game, form = parts[1:]
-            data = {
-                "tournament_name": name,
-                "game": game,
-                "form": form,
-                "tournament": tournament
-            }
-            modal = RegistrationModalOne(title="Registration from tournament",
-                                         custom_id="registration_modal", data=data,
-                                         googleSheetsManager=googleSheetsManager)
-            await inter.response.send_modal(modal)
-        elif parts[0] == "cancel_button":
-            await inter.response.defer()
-
-            role = disnake.utils.get(inter.guild.roles, name=parts[1])
-            tournament = parts[1]
-
-            if role:
-                await inter.user.remove_roles(role)
-
-            await googleSheetsManager.set_deleted_from_tournament(inter.user.name, tournament)
-            await clear_messages(inter)
-
-            channel_name = inter.channel.name
-
-            if messages_cache.get(channel_name) is not None:
-                del messages_cache[channel_name]
-
-            embed = disnake.Embed(title="List of participants:", color=7339915)
-
-            users_list = googleSheetsManager.get_item_by_field(tournament)
+        await componentRouter.dispatch(inter)
 
-            participants = ""
 
-            for user in users_list:
-                if user[9] != "DELETED":
-                    participants += f"{user[0]}\n"
-
-            embed.description = participants
+@componentRouter.route("registration_button", str, str, str, str)
+async def registration_button(inter, name, tournament, game, form):
+    context = await get_guild_context(inter)
+    if context is None:
+        return
+    data = {
+        "tournament_name": name,
+        "game": game,
+        "form": form,
+        "tournament": tournament
+    }
+    modal = RegistrationModalOne(title="Registration from tournament",
+                                 custom_id="registration_modal", data=data,
+                                 registrationStore=context.registrationStore, rosterManager=context.rosterManager,
+                                 nameIndex=nameIndex, interactionGuard=interactionGuard)
+    await inter.response.send_modal(modal)
+
+
+@componentRouter.route("cancel_button", str)
+async def cancel_button(inter, tournament):
+    context = await get_guild_context(inter)
+    if context is None:
+        return
+    await cancel_registration(inter, tournament, stateStore, context.registrationStore, context.rosterManager,
+                              nameIndex, interactionGuard)
 
-            await inter.followup.send(embed=embed)
 
-            await inter.followup.send("Participation in the tournament has been canceled", ephemeral=True)
+@componentRouter.route("roster_page", str, int)
+async def roster_page(inter, tournament, page):
+    context = await get_guild_context(inter)
+    if context is None:
+        return
+    await context.rosterManager.show_page(inter, tournament, page)
 
 
 async def get_category(ctx):
@@ -190,66 +238,27 @@ async def get_category(ctx):
     return False
 
 
-def add_role_to_json(role, confirmation_id, tournament_id):
-    roles_data = {}
-    try:
-        with open("roles.json", "r") as file:
-            roles_data = json.load(file)
-    except FileNotFoundError:
-        roles_data = {}
-
-    roles_data[str(role.id)] = {"role_name": f"{role.name}",
-                                "creation_date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                                "confirmation_channel_id": f"{confirmation_id}",
-                                "tournament_channel_id": f"{tournament_id}"}
-
-    with open("roles.json", "w") as file:
-        json.dump(roles_data, file)
+async def shutdown():
+    await guildRegistry.close()
+    if metricsServer is not None:
+        await metricsServer.close()
+    stateStore.close()
+    if not bot.is_closed():
+        await bot.close()
 
 
-async def remove_old_roles():
-    current_time = datetime.now()
-    one_week_ago = current_time - timedelta(days=7)
+async def main():
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(shutdown()))
+        except NotImplementedError:
+            pass
 
     try:
-        with open("roles.json", "r") as file:
-            roles_data = json.load(file)
-    except FileNotFoundError:
-        return
+        await bot.start(TOKEN)
+    finally:
+        await shutdown()
 
-    removed_count = 0
-    for role_id, role_info in list(roles_data.items()):
-        if datetime.fromisoformat(role_info["creation_date"]) < one_week_ago:
-            try:
-                guild = next((g for g in bot.guilds if int(g.id) == int(guild_id)), None)
-                if guild:
-                    role = guild.get_role(int(role_id))
-                    confirmation_channel = guild.get_channel(int(role_info["confirmation_channel_id"]))
-                    tournament_channel = guild.get_channel(int(role_info["tournament_channel_id"]))
-
-                    await confirmation_channel.delete()
-                    await tournament_channel.delete()
-
-                    if role:
-                        await role.delete()
-                        del roles_data[role_id]
-                        removed_count += 1
-                        print(f"Роль '{role_info['role_name']}' удалена из сервера {guild.name}")
-            except Exception as e:
-                print(f"Ошибка при удалении роли {role_info['role_name']}: {e}")
-
-    if removed_count > 0:
-        with open("roles.json", "w") as file:
-            json.dump(roles_data, file)
-        print(f"Удалено {removed_count} старых ролей.")
-    else:
-        print("Нет ролей для удаления.")
-
-
-async def schedule_remove_old_roles():
-    while True:
-        await remove_old_roles()
-        await asyncio.sleep(86400)  # 86400 секунд = 24 часа
-
-
-bot.run(TOKEN)
+
+bot.loop.run_until_complete(main())
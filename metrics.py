@@ -0,0 +1,221 @@
+import asyncio
+import bisect
+import functools
+import os
+import threading
+import time
+
+from aiohttp import web
+
+from logger import get_logger
+
+loggerMetrics = get_logger(os.path.basename(__file__))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+registry = {}
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                     for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, description):
+        super().__init__(name, description)
+        self.collectors = []
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def track(self, callback, **labels):
+        return self.collect(lambda: [(labels, callback())])
+
+    def collect(self, callback):
+        # The callback returns (labels, value) pairs and is evaluated on every scrape
+        self.collectors.append(callback)
+        return callback
+
+    def remove(self, callback):
+        if callback in self.collectors:
+            self.collectors.remove(callback)
+
+    def samples(self):
+        samples = super().samples()
+        for callback in self.collectors:
+            try:
+                samples += [(self.name, tuple(sorted(labels.items())), value) for labels, value in callback()]
+            except Exception as error:
+                loggerMetrics.error(f"Collector for {self.name} failed: {error}")
+        return samples
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    samples.append((f"{self.name}_bucket", labels + (("le", bound),), cumulative))
+                samples.append((f"{self.name}_sum", labels, round(total, 6)))
+                samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Timer:
+    """Observes elapsed time into a histogram; works as a context manager and as a decorator."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with Timer(self.histogram, self.labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def register(metric_class, name, description, **kwargs):
+    metric = registry.get(name)
+    if metric is None:
+        metric = registry[name] = metric_class(name, description, **kwargs)
+    return metric
+
+
+def counter(name, description):
+    return register(Counter, name, description)
+
+
+def gauge(name, description):
+    return register(Gauge, name, description)
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    return register(Histogram, name, description, buckets=buckets)
+
+
+def render():
+    return "\n".join(metric.render() for metric in registry.values()) + "\n"
+
+
+def status_code(error):
+    # HTTP status first: disnake keeps Discord's own error code in .code
+    code = getattr(error, "status_code", None) or getattr(error, "status", None) or getattr(error, "code", None) \
+        or getattr(getattr(error, "response", None), "status_code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+
+def status_of(error):
+    if error is None:
+        return "ok"
+    code = status_code(error)
+    return str(code) if code is not None else type(error).__name__
+
+
+upstream_requests = counter("upstream_requests_total", "Calls to external APIs by upstream, operation and status")
+upstream_latency = histogram("upstream_request_seconds", "Latency of external API calls")
+interaction_latency = histogram("interaction_seconds", "End-to-end latency of Discord interaction handlers")
+sync_latency = histogram("participant_sync_tick_seconds", "Duration of one participant service sync tick")
+queue_depth = gauge("queue_depth", "Items waiting in in-process queues")
+rate_limit_delay = histogram("rate_limit_delay_seconds", "Time a request waited for its rate-limit bucket")
+rate_limit_penalties = counter("rate_limit_penalties_total", "Rate-limit responses that blocked a bucket")
+
+
+class MetricsServer:
+    def __init__(self, host=None, port=None):
+        self.host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+        self.port = int(port or os.getenv("METRICS_PORT", 9108))
+        self.runner = None
+
+    async def handle(self, request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        loggerMetrics.info(f"Metrics are served on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
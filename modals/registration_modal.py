@@ -1,20 +1,13 @@
 import disnake
 from disnake.ui import Modal, TextInput
 
+import metrics
 from choices_list import FORMAT
 
-messages_cache = {}
-
-
-async def clear_messages(inter):
-    messages = await inter.channel.history(limit=None).flatten()
-    if len(messages) > 1:
-        for message in messages[:-1]:
-            await message.delete()
-
 
 class RegistrationModalOne(Modal):
-    def __init__(self, title: str, custom_id: str, data: dict, googleSheetsManager):
+    def __init__(self, title: str, custom_id: str, data: dict, registrationStore, rosterManager, nameIndex,
+                 interactionGuard):
         input_name = "Team Name" if data["form"] != FORMAT.get("1x1") else "Nickname"
 
         components = [
@@ -45,9 +38,13 @@ class RegistrationModalOne(Modal):
             )
 
         self.data = data
-        self.googleSheetsManager = googleSheetsManager
+        self.registrationStore = registrationStore
+        self.rosterManager = rosterManager
+        self.nameIndex = nameIndex
+        self.interactionGuard = interactionGuard
         super().__init__(title=title, custom_id=custom_id, components=components)
 
+    @metrics.interaction_latency.time(handler="registration_modal")
     async def callback(self, interaction: disnake.ModalInteraction):
         user_data = {}
         for key, value in interaction.text_values.items():
@@ -68,58 +65,38 @@ class RegistrationModalOne(Modal):
                 else:
                     teammates += team_tmp.strip()
 
-        users_list = self.googleSheetsManager.get_item_by_field(user_data["tournament"])
+        # A repeated submit gets the answer of the first one without touching Sheets or Discord, even when throttled
+        key = ("register", user_data["tournament"], user_data["discord"].lower())
+        if self.interactionGuard.get(key):
+            return await interaction.response.send_message(self.interactionGuard.get(key), ephemeral=True)
+
+        if not self.interactionGuard.allow(interaction.user.id, interaction.channel.id):
+            return await interaction.response.send_message("Too many attempts, please wait a few seconds and try "
+                                                           "again", ephemeral=True)
 
-        for user in users_list:
-            if user[0].lower() == user_data.get("nickname").lower():
-                return await interaction.response.send_message("This nickname is already registered, try another one",
-                                                               ephemeral=True)
-            if user[4].lower() == user_data.get("discord").lower():
-                return await interaction.response.send_message("This discord has already been registered, try another "
+        async with self.interactionGuard.lock(key):
+            if self.interactionGuard.get(key):
+                return await interaction.response.send_message(self.interactionGuard.get(key), ephemeral=True)
+
+            if self.registrationStore.find_by_nickname(user_data["tournament"], user_data.get("nickname")):
+                return await interaction.response.send_message("This nickname is already registered, try another "
                                                                "one", ephemeral=True)
+            if self.registrationStore.find_by_discord(user_data["tournament"], user_data.get("discord")):
+                return await interaction.response.send_message("This discord has already been registered, try "
+                                                               "another one", ephemeral=True)
+
+            await self.registrationStore.add([
+                user_data.get("nickname"), user_data.get("phone"), user_data.get("branch"),
+                teammates, user_data.get("discord"), self.data["game"], self.data["form"], user_data["tournament"],
+                user_data["tournament_name"]
+            ])
+            self.interactionGuard.remember(key, "Registration is completed!")
+            self.interactionGuard.forget(("cancel", user_data["tournament"], user_data["discord"].lower()))
+
+        await interaction.response.send_message("Registration is completed!", ephemeral=True)
 
-        channel_name = interaction.channel.name
-
-        await clear_messages(interaction)
-        embed = disnake.Embed(title="List of participants:", color=7339915)
-
-        messages_cache[channel_name] = {}
-        messages_cache[channel_name]["users"] = []
-
-        participants = "\n".join(user_item[0] for user_item in users_list if user_item[9] != "DELETED")
-        participants += f'\n{user_data.get("nickname")}'
-
-        messages_cache[channel_name]["users"] = [user_item[0] for user_item in users_list]
-        messages_cache[channel_name]["users"].append(user_data.get("nickname"))
-
-        embed.description = participants
-
-        await interaction.response.send_message(embed=embed)
-        messages_cache[channel_name]["message"] = await interaction.original_message()
-        # else:
-        #     if user_data.get("nickname").lower() not in [user.lower() for user in
-        #                                                  messages_cache[channel_name]["users"]]:
-        #         messages_cache[channel_name]["users"].append(user_data.get("nickname"))
-        #         old_embed = messages_cache[channel_name]["message"].embeds[0]
-        #         new_embed = disnake.Embed(
-        #             title=old_embed.title,
-        #             color=old_embed.color
-        #         )
-        #
-        #         participants = "\n".join(messages_cache[channel_name]["users"])
-        #         new_embed.description = participants
-        #
-        #         messages_cache[channel_name]["message"] = await messages_cache[channel_name]["message"].edit(
-        #             embed=new_embed)
-        #
-        #     await interaction.response.send_message("Registration is completed!", ephemeral=True)
-
-        role = disnake.utils.get(interaction.guild.roles, name=self.data["tournament_name"])
+        role = self.nameIndex.get_role(interaction.guild, self.data["tournament_name"])
         if role:
             await interaction.user.add_roles(role)
 
-        await self.googleSheetsManager.add_new_user([
-            user_data.get("nickname"), user_data.get("phone"), user_data.get("branch"),
-            teammates, user_data.get("discord"), self.data["game"], self.data["form"], user_data["tournament"],
-            user_data["tournament_name"]
-        ])
+        self.rosterManager.schedule_update(interaction.channel, user_data["tournament"])
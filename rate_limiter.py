@@ -0,0 +1,149 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+
+import metrics
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+INTERACTIVE = 0
+BACKGROUND = 10
+
+# Priority of the calls made by the current task; background loops lower it for themselves
+priority = contextvars.ContextVar("priority", default=INTERACTIVE)
+
+
+class PriorityTokenBucket(TokenBucket):
+    def __init__(self, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self.blocked_until = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._timer = None
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def _grant(self):
+        while self._waiters:
+            self._refill()
+            now = time.monotonic()
+            if self.blocked_until > now:
+                delay = self.blocked_until - now
+            elif self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+            else:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    self.tokens -= 1
+                    future.set_result(None)
+                continue
+
+            if self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+            return
+
+    def _on_timer(self):
+        self._timer = None
+        self._grant()
+
+    async def acquire(self, tokens=1, priority=INTERACTIVE):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self._grant()
+        await future
+
+
+class RateLimitGovernor:
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}
+        self.metrics = {}
+        metrics.queue_depth.collect(lambda: [({"queue": f"rate_limit:{upstream}"}, len(bucket._waiters))
+                                             for upstream, bucket in list(self.buckets.items())])
+
+    def bucket(self, upstream):
+        bucket = self.buckets.get(upstream)
+        if bucket is None:
+            if callable(self.limits):
+                self.limits = self.limits()
+            # "discord:create_channel" and friends share the limits configured for "discord"
+            bucket = PriorityTokenBucket(*self.limits[upstream.split(":")[0]])
+            self.buckets[upstream] = bucket
+            self.metrics[upstream] = {"calls": 0, "throttled": 0, "delay_seconds": 0.0, "max_delay_seconds": 0.0,
+                                      "penalties": 0}
+        return bucket
+
+    async def acquire(self, upstream):
+        bucket = self.bucket(upstream)
+        started = time.monotonic()
+        await bucket.acquire(priority=priority.get())
+        delay = time.monotonic() - started
+        metrics.rate_limit_delay.observe(delay, upstream=upstream)
+
+        counters = self.metrics[upstream]
+        counters["calls"] += 1
+        if delay > 0.001:
+            counters["throttled"] += 1
+            counters["delay_seconds"] += delay
+            counters["max_delay_seconds"] = max(counters["max_delay_seconds"], delay)
+
+    def penalize(self, upstream, retry_after):
+        self.bucket(upstream).block(retry_after)
+        self.metrics[upstream]["penalties"] += 1
+        metrics.rate_limit_penalties.inc(upstream=upstream)
+
+    def update_from_headers(self, upstream, headers):
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            self.penalize(upstream, retry_after)
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            reset_after = headers.get("X-RateLimit-Reset-After")
+            if reset_after is not None:
+                self.bucket(upstream).block(float(reset_after))
+
+    def stats(self):
+        return {upstream: dict(counters) for upstream, counters in self.metrics.items()}
+
+
+def parse_retry_after(headers, default=None):
+    value = headers.get("Retry-After") if headers else None
+    try:
+        return float(value) if value is not None else default
+    except ValueError:
+        return default
+
+
+def default_limits():
+    return {
+        "sheets_read": (float(os.getenv("SHEETS_READ_RATE", 1)), int(os.getenv("SHEETS_READ_BURST", 10))),
+        "sheets_write": (float(os.getenv("SHEETS_WRITE_RATE", 1)), int(os.getenv("SHEETS_WRITE_BURST", 10))),
+        "challonge": (float(os.getenv("CHALLONGE_RATE_LIMIT", 5)), None),
+        "discord": (float(os.getenv("DISCORD_RATE_LIMIT", 10)), None),
+    }
+
+
+# Limits are read on first use so that the .env file has been loaded by then
+governor = RateLimitGovernor(default_limits)
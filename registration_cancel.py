@@ -0,0 +1,24 @@
+async def cancel_registration(inter, tournament, stateStore, registrationStore, rosterManager, nameIndex,
+                              interactionGuard):
+    await inter.response.defer()
+
+    key = ("cancel", tournament, inter.user.name.lower())
+    # A repeated press is answered like the first one instead of counting against the throttle
+    if not interactionGuard.get(key) and not interactionGuard.allow(inter.user.id, inter.channel.id):
+        return await inter.followup.send("Too many attempts, please wait a few seconds and try again", ephemeral=True)
+
+    async with interactionGuard.lock(key):
+        if not interactionGuard.get(key):
+            # The button only carries the Challonge ID, so the role comes from the channel's tournament record
+            record = stateStore.get_tournament_by_channel(inter.channel.id)
+            role = inter.guild.get_role(record["role_id"]) if record else nameIndex.get_role(inter.guild, tournament)
+
+            if role:
+                await inter.user.remove_roles(role)
+
+            await registrationStore.set_deleted(inter.user.name, tournament)
+            rosterManager.schedule_update(inter.channel, tournament)
+            interactionGuard.remember(key, True)
+            interactionGuard.forget(("register", tournament, inter.user.name.lower()))
+
+    await inter.followup.send("Participation in the tournament has been canceled", ephemeral=True)
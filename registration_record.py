@@ -0,0 +1,139 @@
+from enum import Enum
+from functools import partial
+from itertools import compress
+from typing import NamedTuple
+
+
+class Status(Enum):
+    PENDING = ""
+    ADDED = "TRUE"
+    NOT_ADDED = "FALSE"
+    DELETED = "DELETED"
+
+    @classmethod
+    def parse(cls, value):
+        status = STATUS_BY_VALUE.get(value)
+        if status is not None:
+            return status
+        try:
+            return cls(value.strip().upper())
+        except (AttributeError, ValueError):
+            return cls.PENDING
+
+
+class Registration(NamedTuple):
+    nickname: str
+    phone: str
+    branch: str
+    teammates: str
+    discord: str
+    game: str
+    format: str
+    tournament: str
+    tournament_name: str
+    status: Status = Status.PENDING
+
+    @classmethod
+    def from_values(cls, values):
+        values = [("" if value is None else str(value)) for value in values[:len(cls._fields)]]
+        values += [""] * (len(cls._fields) - len(values))
+        return cls(*values[:-1], Status.parse(values[-1]))
+
+    @property
+    def user_key(self):
+        return self.discord.lower() if self.discord else f"#{self.nickname.lower()}"
+
+    def to_values(self):
+        return [*self[:-1], self.status.value]
+
+
+STATUS_BY_VALUE = {status.value: status for status in Status}
+
+# Positions in the sheet layout the bot writes (columns A:J)
+NICKNAME_COLUMN, DISCORD_COLUMN, TOURNAMENT_COLUMN, STATUS_COLUMN = \
+    (Registration._fields.index(name) for name in ("nickname", "discord", "tournament", "status"))
+ACTIVE = frozenset(Status) - {Status.DELETED}
+
+HEADER_ALIASES = {
+    "nickname": ("nickname", "nick", "teamname", "name"),
+    "phone": ("phone", "phonenumber"),
+    "branch": ("branch",),
+    "teammates": ("teammates", "playersnicknames", "players"),
+    "discord": ("discord",),
+    "game": ("game",),
+    "format": ("format", "form"),
+    "tournament": ("tournament", "tournamentid", "challonge", "challongeid"),
+    "tournament_name": ("tournamentname",),
+    "status": ("added", "status"),
+}
+
+
+def normalize_header(value):
+    return "".join(character for character in str(value).lower() if character.isalnum())
+
+
+class RowParser:
+    """Maps raw sheet rows to Registration fields; columns are found by header name, else by position."""
+
+    def __init__(self, columns=None):
+        self.columns = tuple(columns or range(len(Registration._fields)))
+        self.width = max(self.columns) + 1
+
+    @classmethod
+    def from_header(cls, header):
+        positions = {}
+        for index, title in enumerate(header or []):
+            positions.setdefault(normalize_header(title), index)
+
+        columns = []
+        for position, field in enumerate(Registration._fields):
+            found = next((positions[alias] for alias in HEADER_ALIASES[field] if alias in positions), None)
+            columns.append(position if found is None or found in columns else found)
+        return cls(columns)
+
+    def column(self, field):
+        return self.columns[Registration._fields.index(field)]
+
+
+class RegistrationTable:
+    """One sheet fetch stored column by column; records are only built for the rows a caller selects."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def parse(cls, rows, parser=None):
+        parser = parser or RowParser()
+        width = parser.width
+        # The Sheets API drops trailing empty cells, so short rows are padded instead of failing
+        padding = [""] * width
+        padded = [row if len(row) >= width else list(row) + padding[len(row):] for row in rows]
+        raw = list(zip(*padded)) if padded else [()] * width
+        columns = {field: raw[index] for field, index in zip(Registration._fields, parser.columns)}
+
+        statuses = list(map(STATUS_BY_VALUE.get, columns["status"]))
+        if None in statuses:
+            statuses = [status or Status.parse(value) for status, value in zip(statuses, columns["status"])]
+        columns["status"] = statuses
+        return cls(columns)
+
+    def __len__(self):
+        return len(self.columns["status"])
+
+    def mask(self, tournament=None, statuses=ACTIVE):
+        # Rows without a nickname are blank or half-filled lines, not registrations
+        nicknames = self.columns["nickname"]
+        if tournament is None:
+            return [bool(nickname) and status in statuses
+                    for nickname, status in zip(nicknames, self.columns["status"])]
+        return [bool(nickname) and current == tournament and status in statuses
+                for nickname, current, status in zip(nicknames, self.columns["tournament"], self.columns["status"])]
+
+    def values(self, *fields, tournament=None, statuses=ACTIVE):
+        mask = self.mask(tournament, statuses)
+        return tuple(list(compress(self.columns[field], mask)) for field in fields)
+
+    def select(self, tournament=None, statuses=ACTIVE):
+        mask = self.mask(tournament, statuses)
+        selected = (compress(self.columns[field], mask) for field in Registration._fields)
+        return list(map(partial(tuple.__new__, Registration), zip(*selected)))
@@ -0,0 +1,121 @@
+import asyncio
+import os
+
+from logger import get_logger
+from rate_limiter import BACKGROUND, priority
+from registration_record import Registration
+
+loggerRegistrationStore = get_logger(os.path.basename(__file__))
+
+
+class RegistrationStore:
+    def __init__(self, googleSheetsManager, sheetsWriteQueue=None, refresh_interval=None):
+        self.googleSheetsManager = googleSheetsManager
+        self.sheetsWriteQueue = sheetsWriteQueue
+        self.refresh_interval = refresh_interval or int(os.getenv("REGISTRATION_REFRESH_INTERVAL", 60))
+        self.by_tournament = {}
+        self.by_nickname = {}
+        self._refreshing = False
+        self._pending_changes = []
+
+    def _index(self, record):
+        users = self.by_tournament.setdefault(record.tournament, {})
+        previous = users.get(record.user_key)
+        if previous is not None:
+            self._unindex(previous)
+            users = self.by_tournament.setdefault(record.tournament, {})
+        users[record.user_key] = record
+        self.by_nickname[(record.tournament, record.nickname.lower())] = record
+
+    def _unindex(self, record):
+        users = self.by_tournament.get(record.tournament)
+        if users is not None:
+            users.pop(record.user_key, None)
+            if not users:
+                del self.by_tournament[record.tournament]
+        key = (record.tournament, record.nickname.lower())
+        indexed = self.by_nickname.get(key)
+        if indexed is not None and indexed.user_key == record.user_key:
+            del self.by_nickname[key]
+
+    def _apply(self, change, record):
+        if change == "add":
+            self._index(record)
+        else:
+            self._unindex(record)
+
+    def _record(self, change, record):
+        self._apply(change, record)
+        if self._refreshing:
+            self._pending_changes.append((change, record))
+
+    def _rebuild(self, records):
+        self.by_tournament = {}
+        self.by_nickname = {}
+        for record in records:
+            self._index(record)
+
+    def _apply_queued(self, item):
+        if item["op"] == "append":
+            self._index(Registration.from_values(item["row"]))
+        else:
+            record = self.find_by_discord(item["tournament"], item["discord"])
+            if record is not None:
+                self._unindex(record)
+
+    async def load(self):
+        self._refreshing = True
+        self._pending_changes = []
+        # Taken before the fetch: a queued write flushed while the sheet is downloading may be missing from it
+        queued = self.sheetsWriteQueue.pending() if self.sheetsWriteQueue else []
+        try:
+            table = await self.googleSheetsManager.get_registrations(self.googleSheetsManager.users_table)
+        finally:
+            self._refreshing = False
+
+        self._rebuild(table.select())
+        for item in queued:
+            self._apply_queued(item)
+        # Replay local writes that happened while the sheet was being downloaded
+        for change, record in self._pending_changes:
+            self._apply(change, record)
+        self._pending_changes = []
+        loggerRegistrationStore.debug(f"Registration store loaded: {len(self.by_nickname)} users")
+
+    async def run_refresh(self):
+        priority.set(BACKGROUND)
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as error:
+                loggerRegistrationStore.error(f"Failed to refresh registration store: {error}")
+
+    def get_tournament_users(self, tournament):
+        return list(self.by_tournament.get(tournament, {}).values())
+
+    def find_by_nickname(self, tournament, nickname):
+        return self.by_nickname.get((tournament, nickname.lower()))
+
+    def find_by_discord(self, tournament, discord):
+        return self.by_tournament.get(tournament, {}).get(discord.lower())
+
+    @property
+    def writer(self):
+        return self.sheetsWriteQueue or self.googleSheetsManager
+
+    async def add(self, user_data):
+        record = Registration.from_values(user_data)
+        self._record("add", record)
+        try:
+            await self.writer.add_new_user(user_data)
+        except Exception:
+            self._record("delete", record)
+            raise
+        return record
+
+    async def set_deleted(self, discord, tournament):
+        record = self.find_by_discord(tournament, discord)
+        if record is not None:
+            self._record("delete", record)
+        return await self.writer.set_deleted_from_tournament(discord, tournament)
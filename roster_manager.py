@@ -0,0 +1,90 @@
+import asyncio
+import math
+import os
+from itertools import islice
+
+import disnake
+from disnake.ui import Button, View
+
+from logger import get_logger
+
+loggerRoster = get_logger(os.path.basename(__file__))
+
+
+async def clear_messages(channel):
+    # Everything after the first (welcome) message goes; purge streams the history and bulk-deletes
+    # messages younger than 14 days, falling back to single deletes for older ones
+    first_message = None
+    async for message in channel.history(limit=1, oldest_first=True):
+        first_message = message
+    if first_message is not None:
+        await channel.purge(limit=None, after=first_message)
+
+
+class RosterManager:
+    def __init__(self, registrationStore, stateStore, debounce=None):
+        self.registrationStore = registrationStore
+        self.stateStore = stateStore
+        self.debounce = debounce or float(os.getenv("ROSTER_DEBOUNCE", 2))
+        self.page_size = int(os.getenv("ROSTER_PAGE_SIZE", 50))
+        self._pending = {}
+
+    def render(self, tournament, page=0):
+        users = self.registrationStore.by_tournament.get(tournament, {})
+        pages = max(1, math.ceil(len(users) / self.page_size))
+        page = min(max(page, 0), pages - 1)
+
+        # Only the requested page is materialised; names are capped so a full page stays under 4096 characters
+        names = islice(users.values(), page * self.page_size, (page + 1) * self.page_size)
+        embed = disnake.Embed(title="List of participants:", color=7339915)
+        embed.description = "\n".join(user.nickname if len(user.nickname) <= 75 else user.nickname[:74] + "…"
+                                      for user in names)
+
+        if pages == 1:
+            return embed, None
+
+        embed.set_footer(text=f"Page {page + 1}/{pages} · {len(users)} participants")
+        view = View(timeout=None)
+        view.add_item(Button(label="◀", style=disnake.ButtonStyle.grey, disabled=page == 0,
+                             custom_id=f"roster_page:{tournament}:{page - 1}"))
+        view.add_item(Button(label="▶", style=disnake.ButtonStyle.grey, disabled=page == pages - 1,
+                             custom_id=f"roster_page:{tournament}:{page + 1}"))
+        return embed, view
+
+    async def show_page(self, inter, tournament, page):
+        embed, view = self.render(tournament, page)
+        if inter.message.flags.ephemeral:
+            await inter.response.edit_message(embed=embed, view=view)
+        else:
+            # Paging the shared list would move it for everyone, so each user gets a private copy
+            await inter.response.send_message(embed=embed, view=view, ephemeral=True)
+
+    def schedule_update(self, channel, tournament):
+        # A pending update renders the latest store state, so registrations inside the window share one edit
+        if channel.id not in self._pending:
+            self._pending[channel.id] = asyncio.create_task(self._update_later(channel, tournament))
+
+    async def _update_later(self, channel, tournament):
+        await asyncio.sleep(self.debounce)
+        self._pending.pop(channel.id, None)
+        try:
+            await self.update(channel, tournament)
+        except Exception as error:
+            loggerRoster.error(f"Failed to update the participant list in {channel.name}: {error}")
+
+    async def update(self, channel, tournament):
+        embed, view = self.render(tournament)
+        message_id = self.stateStore.get_roster_message(channel.id)
+
+        if message_id is not None:
+            try:
+                await channel.get_partial_message(message_id).edit(embed=embed, view=view)
+                return
+            except disnake.NotFound:
+                loggerRoster.info(f"Participant list message in {channel.name} is gone, posting a new one")
+        else:
+            # Channels created before persistent rosters still hold reposted lists
+            await clear_messages(channel)
+
+        message = await channel.send(embed=embed, view=view)
+        self.stateStore.set_roster_message(channel.id, message.id)
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+
+from logger import get_logger
+import metrics
+from registration_record import DISCORD_COLUMN, STATUS_COLUMN, TOURNAMENT_COLUMN
+
+loggerWriteQueue = get_logger(os.path.basename(__file__))
+
+
+def is_retryable(error):
+    # Failures without an HTTP status (connection resets, read timeouts, token refresh errors) are transient too
+    code = metrics.status_code(error)
+    return code is None or code == 429 or code >= 500
+
+
+class SheetsWriteQueue:
+    def __init__(self, googleSheetsManager, flush_interval=None, max_size=None, max_batch=None,
+                 journal_path=None, max_backoff=60, name="sheets_write"):
+        self.googleSheetsManager = googleSheetsManager
+        self.flush_interval = flush_interval or float(os.getenv("SHEETS_FLUSH_INTERVAL", 1))
+        self.max_size = max_size or int(os.getenv("SHEETS_QUEUE_SIZE", 1000))
+        self.max_batch = max_batch or int(os.getenv("SHEETS_MAX_BATCH", 200))
+        self.journal_path = journal_path or os.getenv("SHEETS_JOURNAL_PATH", "sheets_journal.jsonl")
+        self.dead_letter_path = f"{self.journal_path}.failed"
+        self.max_backoff = max_backoff
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._pending = {}
+        self._next_id = 0
+        self._task = None
+        self.listeners = []
+        self._depth_collector = metrics.queue_depth.track(self.qsize, queue=name)
+
+    def pending(self):
+        return list(self._pending.values())
+
+    def qsize(self):
+        return len(self._pending)
+
+    async def add_new_user(self, user_data):
+        await self._put({"op": "append", "row": list(user_data)})
+
+    async def set_deleted_from_tournament(self, discord, tournament):
+        await self._put({"op": "status", "discord": discord, "tournament": tournament, "status": "DELETED"})
+        return True
+
+    def _track(self, item, journal=True):
+        self._next_id += 1
+        item["id"] = self._next_id
+        self._pending[item["id"]] = item
+        if journal:
+            with open(self.journal_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(item) + "\n")
+
+    async def _put(self, item, journal=True):
+        self._track(item, journal)
+        await self._queue.put(item)
+
+    def _rewrite_journal(self):
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for item in self._pending.values():
+                file.write(json.dumps(item) + "\n")
+        os.replace(tmp_path, self.journal_path)
+
+    def _load_journal(self):
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as file:
+                return [json.loads(line) for line in file if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    async def start(self):
+        if self._task is not None:
+            return
+        items = self._load_journal()
+        for item in items:
+            item.pop("id", None)
+            self._track(item, journal=False)
+        self._rewrite_journal()
+        # The journal can hold more than max_size writes, so the consumer has to run while they are queued
+        self._task = asyncio.create_task(self.run())
+        for item in items:
+            await self._queue.put(item)
+        if items:
+            loggerWriteQueue.info(f"Restored {len(items)} queued sheet writes from {self.journal_path}")
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        # Give the rest of a registration burst a moment to arrive before flushing
+        await asyncio.sleep(self.flush_interval)
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    @staticmethod
+    def _coalesce(batch):
+        appends = []
+        statuses = {}
+        for item in batch:
+            if item["op"] == "append":
+                appends.append(list(item["row"]))
+                continue
+            # A status change for a row that is still queued is folded into the append itself
+            key = (item["tournament"], item["discord"])
+            queued = next((row for row in reversed(appends) if (row[TOURNAMENT_COLUMN], row[DISCORD_COLUMN]) == key),
+                          None)
+            if queued is not None:
+                queued += [""] * (STATUS_COLUMN + 1 - len(queued))
+                queued[STATUS_COLUMN] = item["status"]
+            else:
+                statuses[key] = item["status"]
+        return appends, statuses
+
+    def _dead_letter(self, batch):
+        with open(self.dead_letter_path, "a", encoding="utf-8") as file:
+            for item in batch:
+                file.write(json.dumps(item) + "\n")
+
+    async def _flush(self, batch):
+        appends, statuses = self._coalesce(batch)
+        delay = 1
+        while True:
+            try:
+                await self.googleSheetsManager.apply_writes(appends, statuses)
+                loggerWriteQueue.debug(f"Flushed {len(batch)} sheet writes "
+                                       f"({len(appends)} appends, {len(statuses)} status changes)")
+                break
+            except Exception as error:
+                if not is_retryable(error):
+                    # Callers were already told the write succeeded, so the batch is kept for a manual replay
+                    self._dead_letter(batch)
+                    loggerWriteQueue.error(f"Moved {len(batch)} sheet writes to {self.dead_letter_path} "
+                                           f"after a non-retryable error: {error}")
+                    break
+                loggerWriteQueue.warning(f"Sheet write failed ({error}), retrying in {delay} seconds")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+        for item in batch:
+            self._pending.pop(item["id"], None)
+            self._queue.task_done()
+        self._rewrite_journal()
+
+        for listener in self.listeners:
+            listener()
+
+    async def run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._flush(batch)
+
+    async def close(self, timeout=30):
+        metrics.queue_depth.remove(self._depth_collector)
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            loggerWriteQueue.warning(f"{self.qsize()} sheet writes left in {self.journal_path} on shutdown")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,235 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+from logger import get_logger
+
+loggerStateStore = get_logger(os.path.basename(__file__))
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# The guild the bot served before guilds were configured; tournaments imported from roles.json belong to it
+DEFAULT_GUILD_ID = int(os.getenv("GUILD_ID") or 1251650828519870532)
+ENV_DEFAULTS = {
+    "users_table": "USERS_DATABASE_TABLE",
+    "challonge_login": "CHALLONGE_LOGIN",
+    "challonge_api_key": "CHALLONGE_API_KEY",
+    "challonge_api_url": "CHALLONGE_API_URL",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tournaments (
+    role_id INTEGER PRIMARY KEY,
+    role_name TEXT NOT NULL,
+    guild_id INTEGER,
+    challonge_id TEXT,
+    creation_date TEXT NOT NULL,
+    confirmation_channel_id INTEGER NOT NULL,
+    tournament_channel_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tournaments_creation_date ON tournaments (creation_date);
+CREATE INDEX IF NOT EXISTS tournaments_confirmation_channel ON tournaments (confirmation_channel_id);
+
+CREATE TABLE IF NOT EXISTS roster_messages (
+    channel_id INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sync_snapshot (
+    tournament_id TEXT NOT NULL,
+    user_key TEXT NOT NULL,
+    username TEXT NOT NULL,
+    added INTEGER NOT NULL,
+    guild_id INTEGER,
+    PRIMARY KEY (tournament_id, user_key)
+);
+
+CREATE TABLE IF NOT EXISTS complete_tournaments (
+    tournament_id TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS guild_configs (
+    guild_id INTEGER PRIMARY KEY,
+    sheet_id TEXT NOT NULL,
+    users_table TEXT,
+    challonge_login TEXT,
+    challonge_api_key TEXT,
+    challonge_api_url TEXT
+);
+"""
+
+
+class StateStore:
+    def __init__(self, path=None):
+        self.path = path or os.getenv("STATE_DB_PATH", "state.db")
+        self.connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self.connection.executescript(SCHEMA)
+        self._import_json()
+        self._import_guild_configs()
+
+    def transaction(self):
+        return Transaction(self.connection)
+
+    def _migrate(self):
+        columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(sync_snapshot)")}
+        if columns and "guild_id" not in columns:
+            self.connection.execute("ALTER TABLE sync_snapshot ADD COLUMN guild_id INTEGER")
+        # Guild configs used to hold copies of the .env values; every row is imported again on start
+        columns = {row["name"]: row["notnull"] for row in self.connection.execute("PRAGMA table_info(guild_configs)")}
+        if columns.get("users_table"):
+            self.connection.execute("DROP TABLE guild_configs")
+
+    def _import_json(self):
+        # One-off migration of the files used before the state database existed
+        roles_file = os.getenv("ROLES_FILE", "roles.json")
+        if os.path.exists(roles_file):
+            with open(roles_file, "r") as file:
+                roles_data = json.load(file)
+            with self.transaction():
+                for role_id, role_info in roles_data.items():
+                    self.connection.execute(
+                        "INSERT OR IGNORE INTO tournaments (role_id, role_name, creation_date, "
+                        "confirmation_channel_id, tournament_channel_id) VALUES (?, ?, ?, ?, ?)",
+                        (int(role_id), role_info["role_name"], role_info["creation_date"],
+                         int(role_info["confirmation_channel_id"]), int(role_info["tournament_channel_id"])))
+            os.replace(roles_file, f"{roles_file}.migrated")
+            loggerStateStore.info(f"Imported {len(roles_data)} tournaments from {roles_file}")
+
+        roster_file = os.getenv("ROSTER_MESSAGES_FILE", "roster_messages.json")
+        if os.path.exists(roster_file):
+            with open(roster_file, "r") as file:
+                messages = json.load(file)
+            with self.transaction():
+                for channel_id, message_id in messages.items():
+                    self.connection.execute("INSERT OR IGNORE INTO roster_messages VALUES (?, ?)",
+                                            (int(channel_id), int(message_id)))
+            os.replace(roster_file, f"{roster_file}.migrated")
+            loggerStateStore.info(f"Imported {len(messages)} roster messages from {roster_file}")
+
+    def _import_guild_configs(self):
+        # The file and .env are the editable sources of the per-guild settings and are applied again on every start
+        guilds = {}
+        guilds_file = os.getenv("GUILDS_FILE", "guilds.json")
+        if os.path.exists(guilds_file):
+            with open(guilds_file, "r") as file:
+                guilds = {int(guild_id): config for guild_id, config in json.load(file).items()}
+            with self.transaction():
+                for guild_id, config in guilds.items():
+                    self._set_guild_config(guild_id, **config)
+            loggerStateStore.info(f"Loaded the configuration of {len(guilds)} guilds from {guilds_file}")
+
+        # A single-guild deployment configured through .env keeps working as DEFAULT_GUILD_ID
+        if os.getenv("SHEET_ID") and DEFAULT_GUILD_ID not in guilds:
+            new = self.get_guild_config(DEFAULT_GUILD_ID) is None
+            with self.transaction():
+                self._set_guild_config(DEFAULT_GUILD_ID, os.getenv("SHEET_ID"))
+                if new:
+                    self.connection.execute("UPDATE sync_snapshot SET guild_id = ? WHERE guild_id IS NULL",
+                                            (DEFAULT_GUILD_ID,))
+            if new:
+                loggerStateStore.info(f"Guild {DEFAULT_GUILD_ID} was configured from the environment")
+
+    def _set_guild_config(self, guild_id, sheet_id, users_table=None, challonge_login=None, challonge_api_key=None,
+                          challonge_api_url=None):
+        # Only explicit values are stored; anything left out is read from the environment when the config is used
+        self.connection.execute("INSERT OR REPLACE INTO guild_configs VALUES (?, ?, ?, ?, ?, ?)",
+                                (guild_id, sheet_id, users_table, challonge_login, challonge_api_key,
+                                 challonge_api_url))
+
+    @staticmethod
+    def _with_defaults(row):
+        if row is None:
+            return None
+        config = dict(row)
+        for field in ("users_table", "challonge_login", "challonge_api_key", "challonge_api_url"):
+            config[field] = config[field] or os.getenv(ENV_DEFAULTS[field])
+        return config
+
+    def get_guild_config(self, guild_id):
+        return self._with_defaults(
+            self.connection.execute("SELECT * FROM guild_configs WHERE guild_id = ?", (guild_id,)).fetchone())
+
+    def get_guild_configs(self):
+        return [self._with_defaults(row)
+                for row in self.connection.execute("SELECT * FROM guild_configs ORDER BY guild_id")]
+
+    def add_tournament(self, role_id, role_name, confirmation_channel_id, tournament_channel_id,
+                       guild_id=None, challonge_id=None, creation_date=None):
+        creation_date = (creation_date or datetime.now()).strftime(DATE_FORMAT)
+        with self.transaction():
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tournaments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (role_id, role_name, guild_id, challonge_id, creation_date, confirmation_channel_id,
+                 tournament_channel_id))
+
+    def get_tournaments(self):
+        return self.connection.execute("SELECT * FROM tournaments ORDER BY creation_date").fetchall()
+
+    def get_tournament(self, role_id):
+        return self.connection.execute("SELECT * FROM tournaments WHERE role_id = ?", (role_id,)).fetchone()
+
+    def get_tournament_by_channel(self, confirmation_channel_id):
+        return self.connection.execute("SELECT * FROM tournaments WHERE confirmation_channel_id = ?",
+                                       (confirmation_channel_id,)).fetchone()
+
+    def delete_tournament(self, role_id):
+        with self.transaction():
+            self.connection.execute("DELETE FROM tournaments WHERE role_id = ?", (role_id,))
+
+    def get_roster_message(self, channel_id):
+        row = self.connection.execute("SELECT message_id FROM roster_messages WHERE channel_id = ?",
+                                      (channel_id,)).fetchone()
+        return row["message_id"] if row else None
+
+    def set_roster_message(self, channel_id, message_id):
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO roster_messages VALUES (?, ?)", (channel_id, message_id))
+
+    def delete_roster_message(self, channel_id):
+        with self.transaction():
+            self.connection.execute("DELETE FROM roster_messages WHERE channel_id = ?", (channel_id,))
+
+    def load_snapshot(self, guild_id=None):
+        # Every guild's service diffs against its own rows only, anything else would look like a removal
+        if guild_id is None:
+            rows = self.connection.execute("SELECT * FROM sync_snapshot")
+        else:
+            rows = self.connection.execute("SELECT * FROM sync_snapshot WHERE guild_id = ?", (guild_id,))
+        return {(row["tournament_id"], row["user_key"]): (row["username"], bool(row["added"])) for row in rows}
+
+    def save_snapshot(self, updates, guild_id=None):
+        with self.transaction():
+            for (tournament_id, user_key), state in updates.items():
+                if state is None:
+                    self.connection.execute("DELETE FROM sync_snapshot WHERE tournament_id = ? AND user_key = ?",
+                                            (tournament_id, user_key))
+                else:
+                    self.connection.execute("INSERT OR REPLACE INTO sync_snapshot VALUES (?, ?, ?, ?, ?)",
+                                            (tournament_id, user_key, state[0], int(state[1]), guild_id))
+
+    def load_complete_tournaments(self):
+        return {row["tournament_id"] for row in self.connection.execute("SELECT * FROM complete_tournaments")}
+
+    def add_complete_tournament(self, tournament_id):
+        with self.transaction():
+            self.connection.execute("INSERT OR IGNORE INTO complete_tournaments VALUES (?)", (tournament_id,))
+
+    def close(self):
+        self.connection.close()
+
+
+class Transaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,58 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from cachetools import TTLCache
+
+from rate_limiter import TokenBucket
+
+
+class Throttle:
+    def __init__(self, rate, capacity, maxsize=10000, idle_ttl=600):
+        self.rate = rate
+        self.capacity = capacity
+        # Idle buckets are full again long before they expire, so dropping them loses nothing
+        self.buckets = TTLCache(maxsize, idle_ttl)
+
+    def allow(self, key):
+        bucket = self.buckets.get(key) or TokenBucket(self.rate, self.capacity)
+        self.buckets[key] = bucket
+        return bucket.try_acquire()
+
+
+class InteractionGuard:
+    def __init__(self, dedupe_ttl=None):
+        dedupe_ttl = dedupe_ttl or int(os.getenv("DEDUPE_TTL", 30))
+        self.results = TTLCache(10000, dedupe_ttl)
+        self.user_throttle = Throttle(float(os.getenv("USER_THROTTLE_RATE", 0.2)),
+                                      int(os.getenv("USER_THROTTLE_BURST", 3)))
+        self.channel_throttle = Throttle(float(os.getenv("CHANNEL_THROTTLE_RATE", 5)),
+                                         int(os.getenv("CHANNEL_THROTTLE_BURST", 20)))
+        self._locks = {}
+
+    def allow(self, user_id, channel_id):
+        return self.user_throttle.allow(user_id) and self.channel_throttle.allow(channel_id)
+
+    def get(self, key):
+        return self.results.get(key)
+
+    def remember(self, key, result):
+        self.results[key] = result
+
+    def forget(self, key):
+        self.results.pop(key, None)
+
+    @asynccontextmanager
+    async def lock(self, key):
+        lock, holders = self._locks.get(key, (None, 0))
+        lock = lock or asyncio.Lock()
+        self._locks[key] = (lock, holders + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, holders = self._locks[key]
+            if holders == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, holders - 1)
@@ -1,116 +1,221 @@
+import asyncio
+import logging
 import os
+import signal
 import traceback
-from time import sleep
-import requests
 from logger import get_logger
+import metrics
+from challonge_cache import ChallongeCache
+from challonge_client import ChallongeClient
 from google_sheets_manager_v2 import GoogleSheetsManager
+from rate_limiter import BACKGROUND, governor, priority
+from registration_record import Status
+from state_store import StateStore
 
 loggerParticipantService = get_logger(os.path.basename(__file__))
 
 
 class TournamentParticipantsService:
-    pending_tournaments = {}
-    complete_tournaments = []
     googleSheetsManager = None
+    challongeClient = None
+    challongeCache = None
+    stateStore = None
     interrupted = False
-    CHALLONGE_API_URL = None
-    username = os.getenv("CHALLONGE_LOGIN")
-    password = os.getenv("CHALLONGE_API_KEY")
-    headers = {'User-Agent': 'Chrome'}
 
-    def __init__(self):
+    def __init__(self, googleSheetsManager=None, challongeClient=None, challongeCache=None, stateStore=None,
+                 guild_id=None):
         self.interrupted = False
-        self.googleSheetsManager = GoogleSheetsManager(os.getenv("SHEET_ID"))
-
-    def get_tournament_data(self, tournament_id):
-        response = requests.get(f"https://api.challonge.com/v1/tournaments/{tournament_id}.json",
-                                auth=(self.username, self.password), headers=self.headers)
-        return response.json()
-
-    def get_participants_data(self, tournament_id):
-        participants = []
-        response = requests.get(f"https://api.challonge.com/v1/tournaments/{tournament_id}/participants.json",
-                                auth=(self.username, self.password), headers=self.headers)
-        response_json = response.json()
-
-        for participant in response_json:
-            participants.append(participant['participant'])
-
-        return participants
-
-    def del_participant_from_tournament(self, tournament_id, participant_id):
-        requests.delete(f"https://api.challonge.com/v1/tournaments/{tournament_id}/participants/{participant_id}.json",
-                        auth=(self.username, self.password), headers=self.headers)
-
-    def add_participant_from_tournament(self, tournament_id, username):
-        data = {
-            "participant": {
-                "name": username
-            }
-        }
-        participant = requests.post(f"https://api.challonge.com/v1/tournaments/{tournament_id}/participants.json",
-                                    auth=(self.username, self.password), headers=self.headers, json=data)
-        return participant.json()['participant']
-
-    def run(self):
-        while True:
+        self.guild_id = guild_id
+        self.stateStore = stateStore or StateStore()
+        self.snapshot = self.stateStore.load_snapshot(guild_id)
+        self.sync_concurrency = int(os.getenv("SYNC_CONCURRENCY", 4))
+        self.sync_interval = float(os.getenv("SYNC_INTERVAL", 5))
+        self.wakeup = asyncio.Event()
+        self.googleSheetsManager = googleSheetsManager or GoogleSheetsManager(os.getenv("SHEET_ID"))
+        self.challongeClient = challongeClient or ChallongeClient()
+        self.challongeCache = challongeCache or ChallongeCache(self.challongeClient, self.stateStore)
+
+    async def get_tournament_data(self, tournament_id):
+        return await self.challongeCache.get_tournament(tournament_id)
+
+    async def get_participants_data(self, tournament_id):
+        return await self.challongeCache.get_participants(tournament_id)
+
+    async def del_participant_from_tournament(self, tournament_id, participant_id):
+        await self.challongeClient.delete_participant(tournament_id, participant_id)
+
+    async def add_participant_from_tournament(self, tournament_id, username):
+        return await self.challongeClient.add_participant(tournament_id, username)
+
+    async def add_participants_to_tournament(self, tournament_id, usernames):
+        if len(usernames) == 1:
+            return [await self.add_participant_from_tournament(tournament_id, usernames[0])]
+        return await self.challongeClient.bulk_add_participants(tournament_id, usernames)
+
+    async def sync_tournament(self, tournament_id, changes):
+        tournament_data = await self.get_tournament_data(tournament_id)
+        if tournament_data['tournament']['state'] != "pending":
+            return
+
+        # The cached roster is updated in place below, so it stays valid until its TTL expires
+        participants = await self.get_participants_data(tournament_id)
+        participants_by_name = {participant["name"].lower(): participant for participant in participants}
+
+        to_delete = []
+        to_add = {}
+        for username, is_participant_added in changes:
+            participant = participants_by_name.get(username.lower())
+
+            if participant and not is_participant_added:
+                to_delete.append(participant)
+            elif not participant and is_participant_added:
+                to_add.setdefault(username.lower(), username)
+
+        await asyncio.gather(*(self.del_participant_from_tournament(tournament_id, participant['id'])
+                               for participant in to_delete))
+        for participant in to_delete:
+            participants.remove(participant)
+            loggerParticipantService.info(f"User {participant['name']} was deleted from tournament"
+                                          f" {tournament_id}")
+
+        if to_add:
+            new_participants = await self.add_participants_to_tournament(tournament_id, list(to_add.values()))
+            participants.extend(new_participants)
+            loggerParticipantService.info(f"Users {', '.join(p['name'] for p in new_participants)} were added in "
+                                          f"tournament {tournament_id}")
+
+    def get_changes(self, table):
+        current = {}
+        for username, tournament_id, status in zip(*table.values("nickname", "tournament", "status")):
+            if tournament_id:
+                current[(tournament_id, username.lower())] = (username, status is Status.ADDED)
+
+        changes = {}
+        for key, state in current.items():
+            if self.snapshot.get(key) != state:
+                changes.setdefault(key[0], {})[key] = state
+        # Rows that disappeared from the sheet (cancelled or removed) no longer take part
+        for key in self.snapshot.keys() - current.keys():
+            changes.setdefault(key[0], {})[key] = None
+        return changes
+
+    async def sync(self):
+        table = await self.googleSheetsManager.get_registrations(self.googleSheetsManager.users_table)
+        changes = self.get_changes(table)
+        if changes and loggerParticipantService.isEnabledFor(logging.DEBUG):
+            loggerParticipantService.debug(f"{sum(len(rows) for rows in changes.values())} changed rows in "
+                                           f"{len(changes)} tournaments, cache: {self.challongeCache.stats()}")
+
+        semaphore = asyncio.Semaphore(self.sync_concurrency)
+
+        async def sync_rows(tournament_id, rows):
+            async with semaphore:
+                if self.challongeCache.is_complete(tournament_id):
+                    loggerParticipantService.debug("Tournament %s is already complete", tournament_id)
+                else:
+                    try:
+                        await self.sync_tournament(tournament_id, [
+                            state if state is not None else (self.snapshot[key][0], False)
+                            for key, state in rows.items()
+                        ])
+                    except Exception as error:
+                        # One broken tournament must not hold back the others; it is retried on the next tick
+                        if metrics.status_code(error) != 404:
+                            loggerParticipantService.error(f"Tournament {tournament_id} was not synced: {error}")
+                            return
+                        # A tournament missing from Challonge is not retried until its rows change again
+                        loggerParticipantService.warning(f"Tournament {tournament_id} was not found on Challonge")
+
+            for key, state in rows.items():
+                if state is None:
+                    self.snapshot.pop(key, None)
+                else:
+                    self.snapshot[key] = state
+            self.stateStore.save_snapshot(rows, self.guild_id)
+
+        results = await asyncio.gather(*(sync_rows(tournament_id, rows) for tournament_id, rows in changes.items()),
+                                       return_exceptions=True)
+        # Failures of a single tournament are handled above; anything else restarts the loop as before
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.interrupted = True
+        self.wakeup.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    async def run(self):
+        loggerParticipantService.debug("Participant service was started")
+        # Background sync yields the shared rate limits to user-facing requests
+        priority.set(BACKGROUND)
+        while not self.interrupted:
             try:
-                loggerParticipantService.debug("Participant service was started")
-                while not self.interrupted:
-                    data = self.googleSheetsManager.get_users_data(os.getenv("USERS_DATABASE_TABLE"))
-                    for index, google_participant_item in enumerate(data):
-                        if not google_participant_item:
-                            continue
-                        if not (google_participant_item[7] or google_participant_item[0]):
-                            continue
-
-                        tournament_id = google_participant_item[7]
-                        username = google_participant_item[0]
-                        add_flag = google_participant_item[9]
-
-                        is_participant_added = True if add_flag == "TRUE" else False
-
-                        if tournament_id in self.complete_tournaments:
-                            loggerParticipantService.debug(f"Tournament {tournament_id} is already complete")
-                            continue
-                        tournament_data = self.get_tournament_data(tournament_id)
-                        if tournament_data['tournament']['state'] == "pending":
-                            participants = self.pending_tournaments.get(tournament_id, None)
-
-                            if participants is None:
-                                participants = self.get_participants_data(tournament_id)
-                                self.pending_tournaments[tournament_id] = participants
-
-                            participant = next((participant for participant in participants
-                                                if participant["name"].lower() == username.lower()), None)
-
-                            if participant:
-                                if not is_participant_added:
-                                    self.del_participant_from_tournament(tournament_id, participant['id'])
-                                    participants.remove(participant)
-                                    loggerParticipantService.info(f"User {participant['name']} was deleted from tournament"
-                                                                  f" {tournament_id}")
-                            elif not participant:
-                                if is_participant_added:
-                                    new_participant = self.add_participant_from_tournament(tournament_id, username)
-
-                                    participants.append(new_participant)
-                                    loggerParticipantService.info(f"User {new_participant['name']} was added in tournament"
-                                                                  f" {tournament_id}")
-                            if add_flag == "DELETED":
-                                loggerParticipantService.info(f'{add_flag} - {index+2}')
-                                self.googleSheetsManager.delete_row(index+2)
-                        else:
-                            self.complete_tournaments.append(tournament_id)
-                    sleep(5)
+                with metrics.sync_latency.time():
+                    await self.sync()
+                if loggerParticipantService.isEnabledFor(logging.DEBUG):
+                    loggerParticipantService.debug(f"Rate limits: {governor.stats()}")
+                await self.wait(self.sync_interval)
             except Exception as e:
                 exception_info = traceback.format_exc()
                 loggerParticipantService.error(f"Сервис столкнулся с ошибкой:\n{e}\n{exception_info}")
                 loggerParticipantService.info("Попытка перезапуска сервиса через 30 секунд...")
-                sleep(30)  # Пауза перед перезапуском сервиса
-                continue
+                await self.wait(30)  # Пауза перед перезапуском сервиса
+        loggerParticipantService.debug("Participant service was stopped")
+
+
+async def main():
+    # Imported here because the registry builds these services itself
+    from guild_registry import create_clients
+
+    stateStore = StateStore()
+    services = []
+    for config in stateStore.get_guild_configs():
+        googleSheetsManager, challongeClient = await create_clients(config)
+        services.append(TournamentParticipantsService(googleSheetsManager, challongeClient, stateStore=stateStore,
+                                                      guild_id=config["guild_id"]))
+    if not services:
+        loggerParticipantService.critical("No guild is configured: set SHEET_ID (with GUILD_ID) or list the guilds "
+                                          "in GUILDS_FILE")
+        stateStore.close()
+        return
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: [service.stop() for service in services])
+        except NotImplementedError:
+            pass
+
+    # Run next to the bot, the service shares the bot's /metrics endpoint; standalone it needs its own port
+    metricsServer = None
+    if os.getenv("SERVICE_METRICS_PORT"):
+        metricsServer = metrics.MetricsServer(port=os.getenv("SERVICE_METRICS_PORT"))
+        try:
+            await metricsServer.start()
+        except Exception as error:
+            loggerParticipantService.error(f"Metrics server could not be started: {error}")
+            await metricsServer.close()
+
+    try:
+        await asyncio.gather(*(service.run() for service in services))
+    finally:
+        if metricsServer is not None:
+            await metricsServer.close()
+        for service in services:
+            await service.challongeClient.close()
+            service.googleSheetsManager.close()
+        stateStore.close()
 
 
 if __name__ == '__main__':
-    tournamentParticipantsService = TournamentParticipantsService()
-    tournamentParticipantsService.run()
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+import asyncio
+import csv
+import io
+import os
+import time
+
+import disnake
+from disnake import PermissionOverwrite
+from disnake.ui import Button, View
+
+from choices_list import FORMAT, GAMES
+from logger import get_logger
+import metrics
+from rate_limiter import governor
+
+loggerProvisioning = get_logger(os.path.basename(__file__))
+
+
+BATCH_COLUMNS = ("prefix", "tournament", "date", "game", "form")
+
+
+class WorkerPool:
+    def __init__(self, size):
+        self.size = size
+        self._semaphores = {}
+
+    async def run(self, coro, route, scope=None):
+        # Discord limits creation routes per guild, so each guild gets its own workers and buckets
+        semaphore = self._semaphores.get(scope)
+        if semaphore is None:
+            semaphore = self._semaphores[scope] = asyncio.Semaphore(self.size)
+        async with semaphore:
+            await governor.acquire(f"discord:{route}:{scope}" if scope else f"discord:{route}")
+            started = time.perf_counter()
+            status = "ok"
+            try:
+                return await coro
+            except Exception as error:
+                status = metrics.status_of(error)
+                raise
+            finally:
+                metrics.upstream_latency.observe(time.perf_counter() - started, upstream="discord", operation=route)
+                metrics.upstream_requests.inc(upstream="discord", operation=route, status=status)
+
+
+# Shared by every /create and /create_batch so that parallel provisioning stays inside Discord's limits
+discordPool = WorkerPool(int(os.getenv("DISCORD_WORKERS", 4)))
+
+
+class ProvisioningError(Exception):
+    def __init__(self, step, error):
+        super().__init__(f"{step} failed: {error}")
+        self.step = step
+        self.error = error
+
+
+class Pipeline:
+    def __init__(self, name, scope=None):
+        self.name = name
+        self.scope = scope
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.created = []
+
+    async def step(self, name, coro, rollback=False, pool=None, route=None):
+        started = time.perf_counter()
+        try:
+            result = await (pool.run(coro, route or name, self.scope) if pool else coro)
+        except Exception as error:
+            raise ProvisioningError(name, error) from error
+        finally:
+            self.timings[name] = time.perf_counter() - started
+        if rollback:
+            self.created.append(result)
+        return result
+
+    async def gather(self, *steps):
+        # Every step is allowed to finish so that anything it created can be rolled back
+        results = await asyncio.gather(*steps, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def rollback(self):
+        results = await asyncio.gather(*(resource.delete() for resource in reversed(self.created)),
+                                       return_exceptions=True)
+        for resource, result in zip(reversed(self.created), results):
+            if isinstance(result, Exception) and not isinstance(result, disnake.NotFound):
+                loggerProvisioning.error(f"{self.name}: failed to roll back {resource}: {result}")
+        self.created = []
+
+    def report(self, status="done"):
+        total = time.perf_counter() - self.started
+        steps = ", ".join(f"{name} {duration * 1000:.0f}ms" for name, duration in self.timings.items())
+        return f"{self.name} {status} in {total:.2f}s ({steps})"
+
+
+def confirmation_overwrites(guild, category):
+    overwrites = dict(category.overwrites) if category else {}
+    overwrites[guild.default_role] = PermissionOverwrite(send_messages=False)
+    return overwrites
+
+
+def build_confirmation_message(tournament_channel, tournament, tournament_name, date, game, form):
+    register_button = Button(label="Confirm", style=disnake.ButtonStyle.green,
+                             custom_id=f"registration_button:{tournament_channel}:{tournament}:{game}:{form}")
+
+    cancel_button = Button(label="Cancel", style=disnake.ButtonStyle.red,
+                           custom_id=f"cancel_button:{tournament}")
+
+    view = View()
+    view.add_item(register_button)
+    view.add_item(cancel_button)
+
+    embed = disnake.Embed(
+        description=f'Welcome to the **True Gamers server**! This is to confirm your participation in the '
+                    f'**{tournament_name}** tournament that will be held on **{date}**.',
+        color=7339915
+    )
+
+    embed.set_footer(text='To confirm your participation, click on the "Confirm" button and fill out the form. '
+                          'We will be waiting for you at our computer club branches.')
+    return embed, view
+
+
+async def provision_tournament(guild, category, prefix, tournament, date, game, form, challongeCache):
+    tournament_channel = prefix + "-tournament"
+    confirmation_channel = prefix + "-confirmation"
+    pipeline = Pipeline(f"Tournament '{prefix}'", scope=guild.id)
+
+    try:
+        # The Challonge lookup, the role and the confirmation channel do not depend on each other
+        tournament_data, new_role, new_confirmation_channel = await pipeline.gather(
+            pipeline.step("challonge", challongeCache.get_tournament(tournament)),
+            pipeline.step("role", guild.create_role(name=tournament_channel), rollback=True, pool=discordPool,
+                          route="create_role"),
+            pipeline.step("confirmation_channel",
+                          guild.create_text_channel(name=confirmation_channel, category=category,
+                                                    overwrites=confirmation_overwrites(guild, category)),
+                          rollback=True, pool=discordPool, route="create_channel"))
+        tournament_name = tournament_data["tournament"]["name"]
+
+        overwrites = {
+            guild.default_role: PermissionOverwrite(read_messages=False),
+            new_role: PermissionOverwrite(read_messages=True)
+        }
+        embed, view = build_confirmation_message(tournament_channel, tournament, tournament_name, date, game, form)
+        new_tournament_channel, _ = await pipeline.gather(
+            pipeline.step("tournament_channel",
+                          guild.create_text_channel(name=tournament_channel, category=category, overwrites=overwrites),
+                          rollback=True, pool=discordPool, route="create_channel"),
+            pipeline.step("confirmation_message", new_confirmation_channel.send(view=view, embed=embed),
+                          pool=discordPool, route="send_message"))
+
+        embed = disnake.Embed(
+            title='Hello, True Gamer!',
+            description=f'There is a conversation about the tournament that will take place {prefix}.',
+            color=7339915
+        )
+        await pipeline.step("tournament_message", new_tournament_channel.send(embed=embed), pool=discordPool,
+                            route="send_message")
+    except ProvisioningError:
+        await pipeline.rollback()
+        loggerProvisioning.error(pipeline.report("rolled back"))
+        raise
+
+    loggerProvisioning.info(pipeline.report())
+    return new_role, new_confirmation_channel, new_tournament_channel
+
+
+def parse_batch_csv(content):
+    reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+    missing = [column for column in BATCH_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+
+    rows = []
+    prefixes = set()
+    for line, row in enumerate(reader, start=2):
+        row = {column: (row[column] or "").strip() for column in BATCH_COLUMNS}
+        if not all(row.values()):
+            raise ValueError(f"line {line}: every column must be filled")
+        # Games and formats may be given either as the displayed choice or as its value
+        row["game"] = GAMES.get(row["game"].upper(), row["game"])
+        row["form"] = FORMAT.get(row["form"], row["form"])
+        if row["game"] not in GAMES.values():
+            raise ValueError(f"line {line}: unknown game '{row['game']}'")
+        if row["form"] not in FORMAT.values():
+            raise ValueError(f"line {line}: unknown format '{row['form']}'")
+        if row["prefix"] in prefixes:
+            raise ValueError(f"line {line}: duplicate prefix '{row['prefix']}'")
+        prefixes.add(row["prefix"])
+        rows.append(row)
+
+    if not rows:
+        raise ValueError("the file has no tournaments")
+    return rows
+
+
+class BatchProgress:
+    ICONS = {"queued": "⏳", "provisioning": "🔧", "done": "✅", "skipped": "⏭️", "failed": "❌"}
+
+    def __init__(self, rows):
+        self.statuses = {row["prefix"]: ("queued", "") for row in rows}
+
+    def set(self, prefix, status, detail=""):
+        self.statuses[prefix] = (status, detail)
+
+    def render(self):
+        counts = [status for status, _ in self.statuses.values()]
+        lines = [f"**Batch: {counts.count('done')}/{len(counts)} created, {counts.count('failed')} failed, "
+                 f"{counts.count('skipped')} skipped**"]
+        for prefix, (status, detail) in self.statuses.items():
+            lines.append(f"{self.ICONS[status]} {prefix} — {detail or status}")
+        content = "\n".join(lines)
+        return content if len(content) <= 2000 else content[:1997] + "..."
+
+
+async def provision_batch(guild, category, rows, challongeCache, nameIndex, on_created, progress):
+    # Each Challonge tournament is fetched once up front; the cache serves the per-tournament lookups
+    await asyncio.gather(*(challongeCache.get_tournament(tournament)
+                           for tournament in {row["tournament"] for row in rows}), return_exceptions=True)
+
+    async def provision(row):
+        if nameIndex.get_channel(guild, row["prefix"] + "-tournament"):
+            return progress.set(row["prefix"], "skipped", "channel already exists")
+        progress.set(row["prefix"], "provisioning")
+        started = time.perf_counter()
+        try:
+            resources = await provision_tournament(guild, category, row["prefix"], row["tournament"], row["date"],
+                                                   row["game"], row["form"], challongeCache)
+        except ProvisioningError as error:
+            return progress.set(row["prefix"], "failed", str(error))
+        on_created(row, *resources)
+        progress.set(row["prefix"], "done", f"{time.perf_counter() - started:.1f}s")
+
+    await asyncio.gather(*(provision(row) for row in rows))